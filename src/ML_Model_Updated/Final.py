@@ -2,9 +2,11 @@ import os
 import pandas as pd
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.impute import SimpleImputer
-from sklearn.model_selection import train_test_split, GridSearchCV, cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 from flask import Flask, request, jsonify
+from retrain_worker import RetrainWorker
+from row_log import RowLog
 
 app = Flask(__name__)
 
@@ -20,11 +22,15 @@ class PatientPredictor:
         self.model = None
         self.scaler = None
         self.df = None
+        self.version = 1
+
+        # Appends go to a row log in front of the CSV instead of rewriting it
+        self.dataset = RowLog(csv_path)
 
     def preprocess_data(self):
         """Preprocess the dataset for model training"""
-        # Load the dataset
-        self.df = pd.read_csv(self.csv_path)
+        # Load the dataset, replaying rows still in the log
+        self.df = self.dataset.load()
         
         # Convert month to numeric
         self.df['Month_Numeric'] = self.df['Month'].map({month: index for index, month in enumerate(MONTH_ORDER, 1)})
@@ -49,21 +55,25 @@ class PatientPredictor:
         self.model = RandomForestRegressor(n_estimators=100, random_state=42)
         self.model.fit(X_train_scaled, y_train)
         
-    def add_new_data(self, previous_month, previous_patients, current_month, department):
-        """Add new data point to the existing dataset"""
-        # Prepare new data point
-        new_data = {
+    def new_row(self, previous_month, previous_patients, current_month, department):
+        """Build a dataset row from a prediction request"""
+        return {
             'Month': current_month,
             'Department': department,
             'Number': previous_patients
         }
+
+    def add_new_data(self, previous_month, previous_patients, current_month, department):
+        """Add new data point to the existing dataset"""
+        # Prepare new data point
+        new_data = self.new_row(previous_month, previous_patients, current_month, department)
         
         # Append new data to the dataframe
         new_df = pd.DataFrame([new_data])
         self.df = pd.concat([self.df, new_df], ignore_index=True)
         
         # Retrain with updated dataset
-        self.save_dataset()
+        self.save_dataset([new_data])
         self.preprocess_data()
         self.train_model()
         
@@ -89,15 +99,18 @@ class PatientPredictor:
         
         return int(predicted_patients[0])
     
-    def save_dataset(self, filename='patient_predicts_evolve.csv'):
-        """Save updated dataset"""
-        self.df.to_csv(filename, index=False)
+    def save_dataset(self, rows):
+        """Append new rows to the dataset log"""
+        self.dataset.append(rows)
 
 # Global predictor initialization
 patient_predictor = PatientPredictor()
 patient_predictor.preprocess_data()
 patient_predictor.train_model()
 
+# New rows are applied by a background retrain; requests serve from the current snapshot
+patient_retrainer = RetrainWorker(patient_predictor)
+
 @app.route('/patient_prediction', methods=['POST'])
 def predict_patient():
     """Endpoint for patient predictions"""
@@ -109,18 +122,22 @@ def predict_patient():
         current_month = data['current_month']
         department = data['department']
         
-        # Add new data and retrain model
-        patient_predictor.add_new_data(previous_month, previous_patients, current_month, department)
+        # Serve from one snapshot even if a retrain swaps in a new model meanwhile
+        predictor = patient_retrainer.current
+
+        # Queue new data for the background retrain
+        patient_retrainer.submit(predictor.new_row(previous_month, previous_patients, current_month, department))
         
         # Predict patients
-        predicted_patients = patient_predictor.predict(current_month, department)
+        predicted_patients = predictor.predict(current_month, department)
         
         return jsonify({
             'predicted_patients': predicted_patients,
             'previous_month': previous_month,
             'current_month': current_month,
             'department': department,
-            'message': 'Model retrained with new data'
+            'model_version': predictor.version,
+            'message': 'New data queued for retraining'
         })
 
     except Exception as e:
@@ -134,11 +151,15 @@ class RequirementPredictor:
         self.imputer = None
         self.label_encoder = None
         self.df = None
+        self.version = 1
 
         # Ensure CSV exists
         if not os.path.exists(csv_path):
             self.create_initial_dataset()
 
+        # Appends go to a row log in front of the CSV instead of rewriting it
+        self.dataset = RowLog(csv_path)
+
     def create_initial_dataset(self):
         """Create an initial dataset if none exists"""
         initial_data = {
@@ -152,8 +173,8 @@ class RequirementPredictor:
 
     def preprocess_data(self):
         """Comprehensive data preprocessing"""
-        # Load the dataset
-        self.df = pd.read_csv(self.csv_path)
+        # Load the dataset, replaying rows still in the log
+        self.df = self.dataset.load()
         
         # Ensure clean numeric data
         self.df['Amount'] = pd.to_numeric(
@@ -232,19 +253,24 @@ class RequirementPredictor:
             print(f"Prediction error: {e}")
             return None
 
+    def new_row(self, previous_month, previous_amount, current_month, item):
+        """Build a dataset row from a prediction request"""
+        return {
+            'Month_name': current_month,
+            'Item_name': item,
+            'Amount': float(str(previous_amount).replace(',', ''))
+        }
+
     def add_new_data(self, previous_month, previous_amount, current_month, item):
         """Add new data point and retrain model"""
         try:
             # Prepare new data point
-            new_data = pd.DataFrame({
-                'Month_name': [current_month],
-                'Item_name': [item],
-                'Amount': [float(str(previous_amount).replace(',', ''))]
-            })
+            row = self.new_row(previous_month, previous_amount, current_month, item)
+            new_data = pd.DataFrame([row])
             
             # Append and save updated dataset
             self.df = pd.concat([self.df, new_data], ignore_index=True)
-            self.save_dataset()
+            self.save_dataset([row])
             
             # Retrain the model with updated data
             self.preprocess_data()
@@ -254,15 +280,18 @@ class RequirementPredictor:
             print(f"Error adding new data: {e}")
             return False
 
-    def save_dataset(self, filename='New_dataset_drugs.csv'):
-        """Save updated dataset"""
-        self.df.to_csv(filename, index=False)
+    def save_dataset(self, rows):
+        """Append new rows to the dataset log"""
+        self.dataset.append(rows)
 
 # Global predictor initialization
 requirement_predictor = RequirementPredictor()
 requirement_predictor.preprocess_data()
 requirement_predictor.train_model()
 
+# New rows are applied by a background retrain; requests serve from the current snapshot
+requirement_retrainer = RetrainWorker(requirement_predictor)
+
 @app.route('/drugs_inventory_pred', methods=['POST'])
 def predict_drugs_inventory():
     """Comprehensive prediction endpoint for drug inventory"""
@@ -274,8 +303,11 @@ def predict_drugs_inventory():
         current_month = data['current_month']
         item = data['item']
         
+        # Serve from one snapshot even if a retrain swaps in a new model meanwhile
+        predictor = requirement_retrainer.current
+
         # Predict requirement with full input context
-        predicted_amount = requirement_predictor.predict(
+        predicted_amount = predictor.predict(
             previous_month, 
             previous_amount, 
             current_month, 
@@ -283,20 +315,21 @@ def predict_drugs_inventory():
         )
         
         if predicted_amount is not None:
-            # Add new data for continuous learning
-            requirement_predictor.add_new_data(
+            # Queue new data for continuous learning in the background
+            requirement_retrainer.submit(predictor.new_row(
                 previous_month, 
                 previous_amount, 
                 current_month, 
                 item
-            )
+            ))
 
             return jsonify({
                 'predicted_amount': predicted_amount,
                 'previous_month': previous_month,
                 'current_month': current_month,
                 'item': item,
-                'message': 'Prediction successful with model update'
+                'model_version': predictor.version,
+                'message': 'Prediction successful, model update queued'
             })
         else:
             return jsonify({
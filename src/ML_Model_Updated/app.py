@@ -1,30 +1,73 @@
 import pickle
 import numpy as np
 import os
-import pandas as pd
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.impute import SimpleImputer
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
 from flask import Flask, request, jsonify
+from retrain_worker import RetrainWorker
+from tree_engine import FastPathModel
+from opd_lookup import OPDLookupTable
+from lazy_resource import LazyResource, warm_up
+from metrics import RequestMetrics, metrics_response, mark_error
+from timing import RequestTiming, span
+from hospital_registry import HospitalRegistry, UnknownHospital, hospital_directory
+from training_orchestrator import CoreBudget
 
 app = Flask(__name__)
 
-# Load pickle models correctly
-with open('xgboost_model.pkl', 'rb') as f:
-    stage_one = pickle.load(f)
-
-with open('medical_priority_predictor.pkl', 'rb') as f:
-    stage_two = pickle.load(f)
+# Per-endpoint request counts and latency histograms, exposed on /metrics
+request_metrics = RequestMetrics().install(app)
+
+# Per-stage timings in a Server-Timing header on every response. TIMING_LOG_SAMPLE_RATE
+# also logs that fraction of requests as JSON lines; REQUEST_PROFILING=1 lets a single
+# request opt into cProfile with ?profile=1 or an X-Profile: 1 header
+request_timing = RequestTiming(
+    log_sample_rate=float(os.environ.get('TIMING_LOG_SAMPLE_RATE', 0)),
+    profiling=os.environ.get('REQUEST_PROFILING') == '1'
+).install(app)
+
+def load_model(path):
+    """Unpickle a priority model, wrapping it in the flat tree engine if enabled"""
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+
+    # Serve small batches from flattened tree arrays instead of the pickled model
+    # (verify parity first with: python tree_engine.py check xgboost_model.pkl medical_priority_predictor.pkl)
+    if os.environ.get('USE_TREE_ENGINE') == '1':
+        model = FastPathModel(model)
+    return model
+
+def load_stage_one():
+    # Optionally precompute stage_one over the whole OPD input grid; the table then
+    # stands in for stage_one so off-grid and batch requests use the reloaded model too
+    if os.environ.get('OPD_LOOKUP_TABLE') == '1':
+        return OPDLookupTable('xgboost_model.pkl', load_model, adjust_priorities).watch()
+    return load_model('xgboost_model.pkl')
+
+# Models load on first use or in the warm-up thread started at the bottom of this file,
+# so pandas, sklearn and xgboost are not imported before Flask starts listening
+stage_one = LazyResource('stage_one', load_stage_one)
+stage_two = LazyResource('stage_two', lambda: load_model('medical_priority_predictor.pkl'))
 
 @app.route('/')
 def home():
     return "MediLink ML Backend Hit!"
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness of every model; 503 until all of them are loaded"""
+    models = {resource.name: resource.status() for resource in LAZY_RESOURCES}
+    ready = all(status['ready'] for status in models.values())
+    return jsonify({'ready': ready, 'models': models}), 200 if ready else 503
+
 @app.route('/opd_priority', methods=['POST'])
 def predict_opd():
     try:
-        data = request.get_json()
+        with span('parse'):
+            data = request.get_json()
         
         # Extract features
         features = np.array([
@@ -36,9 +79,19 @@ def predict_opd():
 
         # Get the patient rating
         patient_rating = int(data['patient_rating'])  # Assume rating is an integer between 1 to 5
+
+        # Serve on-grid inputs straight from the precomputed table
+        with span('load'):
+            model = stage_one.get()
+        if isinstance(model, OPDLookupTable):
+            with span('lookup'):
+                final_priority = model.lookup(features[0], patient_rating)
+            if final_priority is not None:
+                return jsonify({'priority': final_priority})
         
         # Predict the priority
-        prediction = stage_one.predict(features)
+        with span('predict'):
+            prediction = model.predict(features)
         rounded_priority = int(np.round(prediction[0]))
 
         # Adjust priority slightly based on patient_rating
@@ -50,19 +103,75 @@ def predict_opd():
 
         return jsonify({'priority': final_priority})
     except Exception as e:
+        mark_error()
+        return jsonify({'error': str(e)})
+
+# Feature order expected by stage_one
+OPD_FEATURES = ['illness_severity', 'age', 'transmittable', 'disabled']
+
+def adjust_priorities(predictions, patient_ratings):
+    """Apply the patient_rating adjustment to a whole array of raw predictions"""
+    rounded_priorities = np.round(predictions)
+    adjustments = 0.2 * (5 - patient_ratings)
+    adjusted_priorities = np.maximum(0, rounded_priorities - adjustments)
+    return np.round(adjusted_priorities).astype(int)
+
+def build_feature_matrix(records, feature_names, results):
+    """Build one float32 matrix from the valid records, noting errors for the rest in results"""
+    features = np.empty((len(records), len(feature_names)), dtype=np.float32)
+    patient_ratings = np.empty(len(records), dtype=np.float32)
+    valid_rows = []
+
+    # Validate each record on its own so one bad row doesn't fail the batch
+    for index, record in enumerate(records):
+        try:
+            features[len(valid_rows)] = [record[name] for name in feature_names]
+            patient_ratings[len(valid_rows)] = int(record['patient_rating'])
+            valid_rows.append(index)
+        except Exception as e:
+            results[index] = {'error': str(e)}
+
+    return features[:len(valid_rows)], patient_ratings[:len(valid_rows)], valid_rows
+
+@app.route('/opd_priority/batch', methods=['POST'])
+def predict_opd_batch():
+    """Score many OPD appointments with a single stage_one call"""
+    try:
+        data = request.get_json()
+        records = data['patients'] if isinstance(data, dict) else data
+
+        results = [None] * len(records)
+        features, patient_ratings, valid_rows = build_feature_matrix(records, OPD_FEATURES, results)
+
+        # Predict all valid rows at once
+        if valid_rows:
+            predictions = stage_one.get().predict(features)
+            priorities = adjust_priorities(predictions, patient_ratings)
+            for index, priority in zip(valid_rows, priorities.tolist()):
+                results[index] = {'priority': priority}
+
+        return jsonify({'results': results})
+    except Exception as e:
+        mark_error()
         return jsonify({'error': str(e)})
 
+# Feature order expected by stage_two
+BED_FEATURES = ['illness_severity', 'doctor_offset', 'age', 'waiting_period', 'transmittable', 'disabled']
+
 @app.route('/bed_priority', methods=['POST'])
 def predict_bed():
     try:
-        data = request.get_json()
+        with span('parse'):
+            data = request.get_json()
 
-        # Define the features to use
-        feature_names = ['illness_severity', 'doctor_offset', 'age', 'waiting_period', 'transmittable', 'disabled']
-        features = np.array([[data[name] for name in feature_names]], dtype=np.float32)
+        # Extract features
+        features = np.array([[data[name] for name in BED_FEATURES]], dtype=np.float32)
 
         # Predict the bed priority
-        prediction = stage_two.predict(features)
+        with span('load'):
+            model = stage_two.get()
+        with span('predict'):
+            prediction = model.predict(features)
         rounded_priority = int(round(prediction[0]))
 
         # Get the patient rating
@@ -77,298 +186,250 @@ def predict_bed():
 
         return jsonify({'priority': final_priority})
     except Exception as e:
+        mark_error()
         return jsonify({'error': str(e)})
 
-# Month order for consistency
-MONTH_ORDER = [
-    'January', 'February', 'March', 'April', 'May', 'June',
-    'July', 'August', 'September', 'October', 'November', 'December'
-]
-
-class PatientPredictor:
-    def __init__(self, csv_path='patient predicts evolve updated.csv'):
-        self.csv_path = csv_path
-        self.model = None
-        self.scaler = None
-        self.df = None
-
-    def preprocess_data(self):
-        """Preprocess the dataset for model training"""
-        # Load the dataset
-        self.df = pd.read_csv(self.csv_path)
-        
-        # Convert month to numeric
-        self.df['Month_Numeric'] = self.df['Month'].map({month: index for index, month in enumerate(MONTH_ORDER, 1)})
-        
-        # One-hot encode departments
-        self.df_encoded = pd.get_dummies(self.df, columns=['Department'], prefix='Dept')
-        
-        # Separate features and target
-        self.X = self.df_encoded.drop(['Month', 'Number'], axis=1)
-        self.y = self.df_encoded['Number']
-        
-    def train_model(self):
-        """Train the Random Forest Regressor"""
-        # Split the data
-        X_train, X_test, y_train, y_test = train_test_split(self.X, self.y, test_size=0.2, random_state=42)
-        
-        # Scale features
-        self.scaler = StandardScaler()
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        
-        # Train model
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.model.fit(X_train_scaled, y_train)
-        
-    def add_new_data(self, previous_month, previous_patients, current_month, department):
-        """Add new data point to the existing dataset"""
-        # Prepare new data point
-        new_data = {
-            'Month': current_month,
-            'Department': department,
-            'Number': previous_patients
-        }
-        
-        # Append new data to the dataframe
-        new_df = pd.DataFrame([new_data])
-        self.df = pd.concat([self.df, new_df], ignore_index=True)
-        
-        # Retrain with updated dataset
-        self.save_dataset()
-        self.preprocess_data()
-        self.train_model()
-        
-    def predict(self, current_month, department):
-        """Predict patients for given month and department"""
-        # Prepare input data
-        current_input = pd.DataFrame({
-            'Month_Numeric': [MONTH_ORDER.index(current_month) + 1],
-            f'Dept_{department}': [1]
-        })
-        
-        # Add zero columns for missing departments
-        for col in self.X.columns:
-            if col not in current_input.columns:
-                current_input[col] = 0
-        
-        # Reorder columns to match training data
-        current_input = current_input[self.X.columns]
-        
-        # Scale and predict
-        current_input_scaled = self.scaler.transform(current_input)
-        predicted_patients = self.model.predict(current_input_scaled)
-        
-        return int(predicted_patients[0])
-    
-    def save_dataset(self, filename='patient_predicts_evolve.csv'):
-        """Save updated dataset"""
-        self.df.to_csv(filename, index=False)
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, highest first, without sorting the whole array"""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+@app.route('/bed_priority/rank', methods=['POST'])
+def rank_bed_waitlist():
+    """Re-rank a department's whole waitlist with a single stage_two call
+
+    order is 'descending' (the default: highest priority first, and top_k keeps the
+    highest) or 'ascending' (lowest first, the order waitlists are stored in; top_k
+    keeps the lowest). Equal priorities keep their waitlist order either way.
+    """
+    try:
+        data = request.get_json()
+        waitlist = data['waitlist']
+        top_k = data.get('top_k')
+        top_k = len(waitlist) if top_k is None else int(top_k)
+        order = data.get('order', 'descending')
+        if order not in ('ascending', 'descending'):
+            mark_error()
+            return jsonify({'error': "order must be 'ascending' or 'descending'"})
+
+        results = [None] * len(waitlist)
+        features, patient_ratings, valid_rows = build_feature_matrix(waitlist, BED_FEATURES, results)
+        errors = [dict(result, index=index) for index, result in enumerate(results) if result is not None]
+
+        ranked = []
+        if valid_rows and top_k > 0:
+            # Score every entry using its current waiting_period
+            predictions = stage_two.get().predict(features)
+            priorities = adjust_priorities(predictions, patient_ratings)
+
+            # Rank by score, highest first; ties go to the earlier waitlist position
+            direction = 1 if order == 'descending' else -1
+            scores = direction * priorities * len(priorities) + np.arange(len(priorities))[::-1]
+            for row in top_k_indices(scores, top_k).tolist():
+                index = valid_rows[row]
+                ranked.append({
+                    'index': index,
+                    'userId': waitlist[index].get('userId'),
+                    'priority': int(priorities[row])
+                })
+
+        return jsonify({'ranked': ranked, 'order': order, 'errors': errors})
+    except Exception as e:
+        mark_error()
+        return jsonify({'error': str(e)})
 
-# Global predictor initialization
-patient_predictor = PatientPredictor()
-patient_predictor.preprocess_data()
-patient_predictor.train_model()
+# Retrain fits and hyperparameter searches together use at most TRAINING_CORE_BUDGET cores
+training_cores = CoreBudget(int(os.environ.get('TRAINING_CORE_BUDGET', 0)) or None)
+
+def load_artifact_store():
+    # Fitted predictors are cached on disk by training data fingerprint, so restarts skip retraining
+    from artifact_store import ArtifactStore
+    from training_orchestrator import TrainingOrchestrator
+
+    # Cache misses are fitted in a process pool within the shared training core budget
+    return ArtifactStore(trainer=TrainingOrchestrator(training_cores).train)
+
+def load_hyperparameter_tuner():
+    from tuning import HyperparameterTuner
+
+    # Searches draw on the same core budget as the fits, one candidate fit per core
+    return HyperparameterTuner(budget=training_cores)
+
+def load_retrainer(predictor_class, csv_path=None, store=None):
+    """Load or train a forecasting predictor and wrap it in its background retrain worker"""
+    from training_set import TrainingPolicy
+    predictor = predictor_class(csv_path) if csv_path else predictor_class()
+    store = store or artifact_store.get()
+
+    # TRAINING_WINDOW, TRAINING_SAMPLE and TRAINING_AGGREGATE bound the rows each fit sees
+    predictor.training_policy = TrainingPolicy.from_environment(os.environ)
+    predictor.preprocess_data()
+
+    # Fit with the cached tuned parameters (see tuning.py), so startup never waits on a search
+    tuner = hyperparameter_tuner.get()
+    tuner.apply(predictor)
+    store.load_or_train(predictor)
+
+    # New rows are applied by a background retrain; requests serve from the current snapshot.
+    # With INCREMENTAL_LEARNING=1 bursts swap trees into the fitted forest instead of refitting it
+    incremental = None
+    if os.environ.get('INCREMENTAL_LEARNING') == '1':
+        from incremental import IncrementalForest
+        incremental = IncrementalForest()
+    retrainer = RetrainWorker(predictor, store, incremental=incremental)
+
+    # With HYPERPARAMETER_TUNING=1, search again in the background when the data has drifted
+    if os.environ.get('HYPERPARAMETER_TUNING') == '1':
+        tuner.watch(retrainer)
+    return retrainer
+
+# Per-hospital datasets live in HOSPITAL_DATA_DIRECTORY/<hospital_id>/ under the same file
+# names as the shared ones. Requests with a hospital_id use that hospital's predictors,
+# of which HOSPITAL_CACHE_SIZE (and at most HOSPITAL_CACHE_MB, if set) stay loaded
+HOSPITAL_DATA_DIRECTORY = os.environ.get('HOSPITAL_DATA_DIRECTORY', 'hospitals')
+
+def hospital_loader(predictor_name):
+    """Loader of one hospital's retrain worker for a predictor class in forecasting.py"""
+    def load(hospital_id):
+        import forecasting
+        from artifact_store import ArtifactStore
+        predictor_class = getattr(forecasting, predictor_name)
+        directory = hospital_directory(HOSPITAL_DATA_DIRECTORY, hospital_id)
+
+        # Artifacts are pruned per directory, so hospitals don't push out each other's fits
+        store = ArtifactStore(os.path.join('model_artifacts', 'hospitals', hospital_id),
+                              trainer=artifact_store.get().trainer)
+        return load_retrainer(predictor_class, os.path.join(directory, predictor_class.DATASET_FILE), store)
+    return load
+
+def hospital_registry(name, predictor_name):
+    max_megabytes = float(os.environ.get('HOSPITAL_CACHE_MB', 0))
+    return HospitalRegistry(name, hospital_loader(predictor_name),
+                            max_resident=int(os.environ.get('HOSPITAL_CACHE_SIZE', 8)),
+                            max_bytes=int(max_megabytes * 2 ** 20) or None)
+
+def load_patient_retrainer():
+    from forecasting import PatientPredictor
+    return load_retrainer(PatientPredictor)
+
+artifact_store = LazyResource('artifact_store', load_artifact_store)
+hyperparameter_tuner = LazyResource('hyperparameter_tuner', load_hyperparameter_tuner)
+patient_retrainer = LazyResource('patient_predictor', load_patient_retrainer)
+patient_hospitals = hospital_registry('patient_predictor', 'PatientPredictor')
+
+@app.route('/patient_prediction/matrix', methods=['GET'])
+def predict_patient_matrix():
+    """Predicted patients for every month and department, for the dashboard charts"""
+    try:
+        from forecasting import MONTH_ORDER
+        hospital_id = request.args.get('hospital_id')
+        retrainer = patient_hospitals.get(hospital_id) if hospital_id else patient_retrainer.get()
+        predictor = retrainer.current
+        snapshot = predictor.snapshot
+        return jsonify({
+            'months': MONTH_ORDER,
+            'departments': snapshot.departments,
+            'predicted_patients': snapshot.prediction_matrix[:, :-1].tolist(),
+            'model_version': predictor.version,
+        })
+    except UnknownHospital as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/patient_prediction', methods=['POST'])
 def predict_patient():
     """Endpoint for patient predictions"""
     try:
         # Get input data
-        data = request.get_json()
+        with span('parse'):
+            data = request.get_json()
         current_month = data.get('current_month')
         department = data.get('department')
         previous_month = data.get('previous_month')
         previous_patients = data.get('previous_patients')
+        hospital_id = data.get('hospital_id')
         
+        # Serve from one snapshot even if a retrain swaps in a new model meanwhile
+        with span('load'):
+            retrainer = patient_hospitals.get(hospital_id) if hospital_id else patient_retrainer.get()
+        predictor = retrainer.current
+
         # Check if previous_month and previous_patients are provided
         if previous_month and previous_patients:
             # Convert to int if provided
             previous_patients = int(previous_patients)
             
-            # Add new data and retrain the model
-            patient_predictor.add_new_data(previous_month, previous_patients, current_month, department)
-            message = 'Model retrained with new data'
+            # Queue new data for the background retrain
+            with span('queue'):
+                retrainer.submit(predictor.new_row(previous_month, previous_patients, current_month, department))
+            message = 'New data queued for retraining'
         else:
             # Use the original dataset without retraining
             message = 'Prediction based on original dataset'
         
         # Predict patients
-        predicted_patients = patient_predictor.predict(current_month, department)
+        predicted_patients = predictor.predict(current_month, department)
         
         return jsonify({
             'predicted_patients': predicted_patients,
             'current_month': current_month,
             'department': department,
+            'model_version': predictor.version,
         })
 
+    except UnknownHospital as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-class RequirementPredictor:
-    def __init__(self, csv_path='New_dataset_drugs.csv'):
-        self.csv_path = csv_path
-        self.model = None
-        self.scaler = None
-        self.imputer = None
-        self.label_encoder = None
-        self.df = None
-
-        # Ensure CSV exists
-        if not os.path.exists(csv_path):
-            self.create_initial_dataset()
-
-    def create_initial_dataset(self):
-        """Create an initial dataset if none exists"""
-        initial_data = {
-            'Month_name': ['January'] * 3,
-            'Item_name': ['Drug A', 'Drug B', 'Drug C'],
-            'Amount': [1000, 1500, 2000]
-        }
-        df = pd.DataFrame(initial_data)
-        df.to_csv(self.csv_path, index=False)
-        print(f"Created initial dataset at {self.csv_path}")
-
-    def preprocess_data(self):
-        """Comprehensive data preprocessing"""
-        # Load the dataset
-        self.df = pd.read_csv(self.csv_path)
-        
-        # Ensure clean numeric data
-        self.df['Amount'] = pd.to_numeric(
-            self.df['Amount'].astype(str).str.replace(',', ''), 
-            errors='coerce'
-        ).fillna(0)
-        
-        # Drop rows with 0 or NaN amounts
-        self.df = self.df[self.df['Amount'] > 0]
-        
-        # Convert month to numeric
-        self.df['Month_Numeric'] = self.df['Month_name'].map({
-            month: index for index, month in enumerate(MONTH_ORDER, 1)
-        })
-        
-        # Label encode item names
-        self.label_encoder = LabelEncoder()
-        self.df['Item_Encoded'] = self.label_encoder.fit_transform(self.df['Item_name'])
-        
-        # Prepare features
-        self.X = self.df[['Month_Numeric', 'Item_Encoded']]
-        self.y = self.df['Amount']
-
-        # Add lag features
-        self.X['Previous_Amount'] = self.y.shift(1).fillna(self.y.mean())
-
-    def train_model(self):
-        """Advanced model training with cross-validation and imputation"""
-        # Impute missing values
-        self.imputer = SimpleImputer(strategy='median')
-        X_imputed = self.imputer.fit_transform(self.X)
-        
-        # Scale features
-        self.scaler = StandardScaler()
-        X_scaled = self.scaler.fit_transform(X_imputed)
-        
-        # Split data
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_scaled, self.y, test_size=0.2, random_state=42
-        )
-        
-        # Train Random Forest with more robust parameters
-        self.model = RandomForestRegressor(
-            n_estimators=200,
-            max_depth=10,
-            min_samples_split=5,
-            random_state=42
-        )
-        self.model.fit(X_train, y_train)
-
-    def predict(self, previous_month, previous_amount, current_month, item):
-        """Predict requirement with comprehensive input"""
-        try:
-            # Convert inputs to appropriate formats
-            previous_amount = float(str(previous_amount).replace(',', ''))
-            
-            # Encode the item
-            item_encoded = self.label_encoder.transform([item])[0]
-            
-            # Prepare input data
-            input_data = pd.DataFrame({
-                'Month_Numeric': [MONTH_ORDER.index(current_month) + 1],
-                'Item_Encoded': [item_encoded],
-                'Previous_Amount': [previous_amount]
-            })
-
-            # Impute and scale input
-            input_imputed = self.imputer.transform(input_data)
-            input_scaled = self.scaler.transform(input_imputed)
-            
-            # Predict and ensure non-negative result
-            predicted_amount = self.model.predict(input_scaled)
-            return max(0, int(predicted_amount[0]))
-        
-        except Exception as e:
-            print(f"Prediction error: {e}")
-            return None
-
-    def add_new_data(self, previous_month, previous_amount, current_month, item):
-        """Add new data point and retrain model"""
-        try:
-            # Prepare new data point
-            new_data = pd.DataFrame({
-                'Month_name': [current_month],
-                'Item_name': [item],
-                'Amount': [float(str(previous_amount).replace(',', ''))]
-            })
-            
-            # Append and save updated dataset
-            self.df = pd.concat([self.df, new_data], ignore_index=True)
-            self.save_dataset()
-            
-            # Retrain the model with updated data
-            self.preprocess_data()
-            self.train_model()
-            return True
-        except Exception as e:
-            print(f"Error adding new data: {e}")
-            return False
-
-    def save_dataset(self, filename='New_dataset_drugs.csv'):
-        """Save updated dataset"""
-        self.df.to_csv(filename, index=False)
+def load_requirement_retrainer():
+    from forecasting import RequirementPredictor
+    return load_retrainer(RequirementPredictor)
 
-# Global predictor initialization
-requirement_predictor = RequirementPredictor()
-requirement_predictor.preprocess_data()
-requirement_predictor.train_model()
+requirement_retrainer = LazyResource('requirement_predictor', load_requirement_retrainer)
+requirement_hospitals = hospital_registry('requirement_predictor', 'RequirementPredictor')
 
 @app.route('/drugs_inventory_pred', methods=['POST'])
 def predict_drugs_inventory():
     """Comprehensive prediction endpoint for drug inventory"""
     try:
         # Extract input data
-        data = request.get_json()
+        with span('parse'):
+            data = request.get_json()
         previous_month = data.get('previous_month')  # Use .get() to handle missing fields
         previous_amount = data.get('previous_amount')
         current_month = data['current_month']
         item = data['item']
+        hospital_id = data.get('hospital_id')
+
+        # Serve from one snapshot even if a retrain swaps in a new model meanwhile
+        with span('load'):
+            retrainer = requirement_hospitals.get(hospital_id) if hospital_id else requirement_retrainer.get()
+        predictor = retrainer.current
 
         if previous_month and previous_amount:  # If previous data is provided
             # Predict requirement based on the previous month and amount
-            predicted_amount = requirement_predictor.predict(
+            predicted_amount = predictor.predict(
                 previous_month, 
                 previous_amount, 
                 current_month, 
                 item
             )
         else:
-            # Predict based on the original dataset if no previous data is provided
-            # Use the most recent data in the dataset to predict
-            last_month_data = requirement_predictor.df.iloc[-1]
-            previous_month = last_month_data['Month_name']
-            previous_amount = last_month_data['Amount']
+            # Without previous data, predict from the item's own most recent row
+            with span('lookup'):
+                latest = predictor.latest_state(item)
+            if latest is None:
+                return jsonify({'error': f'No history for item {item}; provide previous_month and previous_amount'}), 400
+            previous_month = latest['last_month']
+            previous_amount = latest['last_amount']
             
-            predicted_amount = requirement_predictor.predict(
+            predicted_amount = predictor.predict(
                 previous_month, 
                 previous_amount, 
                 current_month, 
@@ -376,26 +437,93 @@ def predict_drugs_inventory():
             )
 
         if predicted_amount is not None:
-            # Add new data for continuous learning
-            requirement_predictor.add_new_data(
-                previous_month, 
-                previous_amount, 
-                current_month, 
-                item
-            )
+            # Queue new data for continuous learning in the background
+            with span('queue'):
+                retrainer.submit(predictor.new_row(
+                    previous_month, 
+                    previous_amount, 
+                    current_month, 
+                    item
+                ))
 
             return jsonify({
                 'predicted_amount': predicted_amount,              
                 'current_month': current_month,
                 'item': item,
+                'model_version': predictor.version,
             })
         else:
             return jsonify({
                 'error': 'Unable to generate prediction'
             }), 500
     
+    except UnknownHospital as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/drugs_inventory_pred/all', methods=['GET'])
+def predict_all_drugs_inventory():
+    """Forecast every known item for current_month in one predict; read-only, nothing is queued"""
+    try:
+        current_month = request.args.get('current_month')
+        if not current_month:
+            return jsonify({'error': 'current_month is required'}), 400
+        hospital_id = request.args.get('hospital_id')
+        with span('load'):
+            retrainer = requirement_hospitals.get(hospital_id) if hospital_id else requirement_retrainer.get()
+        predictor = retrainer.current
+
+        return jsonify({
+            'current_month': current_month,
+            'predictions': predictor.predict_all(current_month),
+            'model_version': predictor.version,
+        })
+    except UnknownHospital as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+FORECASTING_RESOURCES ={'patient': patient_retrainer, 'requirement': requirement_retrainer}
+HOSPITAL_REGISTRIES = {'patient': patient_hospitals, 'requirement': requirement_hospitals}
+
+@app.route('/hospitals', methods=['GET'])
+def hospital_cache():
+    """Resident hospitals and cache hit rate and evictions, per predictor"""
+    return jsonify({name: registry.status() for name, registry in HOSPITAL_REGISTRIES.items()})
+
+@app.route('/forecasting/refit', methods=['POST'])
+def refit_forecasting():
+    """Queue a full refit of one forecasting predictor, or all of them"""
+    try:
+        data = request.get_json(silent=True) or {}
+        names = [data['predictor']] if data.get('predictor') else list(FORECASTING_RESOURCES)
+        for name in names:
+            FORECASTING_RESOURCES[name].get().request_refit()
+        return jsonify({'queued': names})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/forecasting/drift', methods=['GET'])
+def forecasting_drift():
+    """Incremental-vs-refit error recorded at each full refit, per predictor"""
+    return jsonify({
+        name: resource.get().drift if resource.ready else []
+        for name, resource in FORECASTING_RESOURCES.items()
+    })
+
+LAZY_RESOURCES = [stage_one, stage_two, artifact_store, patient_retrainer, requirement_retrainer]
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of request, model, retrain and dataset metrics"""
+    return metrics_response(request_metrics, LAZY_RESOURCES, FORECASTING_RESOURCES, HOSPITAL_REGISTRIES)
+
+# Load everything in the background so /readyz turns green without waiting for traffic.
+# Fit workers started with spawn or forkserver import this module again as __mp_main__,
+# and must not load the models themselves
+if os.environ.get('LAZY_WARM_UP', '1') == '1' and __name__ != '__mp_main__':
+    warm_up(LAZY_RESOURCES)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -3,6 +3,8 @@ from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestRegressor
 from flask import Flask, request, jsonify
+from retrain_worker import RetrainWorker
+from row_log import RowLog
 
 # Month order for consistency
 MONTH_ORDER = ['January', 'February', 'March', 'April', 'May', 'June',
@@ -14,11 +16,15 @@ class PatientPredictor:
         self.model = None
         self.scaler = None
         self.df = None
+        self.version = 1
+
+        # Appends go to a row log in front of the CSV instead of rewriting it
+        self.dataset = RowLog(csv_path)
 
     def preprocess_data(self):
         """Preprocess the dataset for model training"""
-        # Load the dataset
-        self.df = pd.read_csv(self.csv_path)
+        # Load the dataset, replaying rows still in the log
+        self.df = self.dataset.load()
         
         # Convert month to numeric
         self.df['Month_Numeric'] = self.df['Month'].map({month: index for index, month in enumerate(MONTH_ORDER, 1)})
@@ -43,21 +49,25 @@ class PatientPredictor:
         self.model = RandomForestRegressor(n_estimators=100, random_state=42)
         self.model.fit(X_train_scaled, y_train)
         
-    def add_new_data(self, previous_month, previous_patients, current_month, department):
-        """Add new data point to the existing dataset"""
-        # Prepare new data point
-        new_data = {
+    def new_row(self, previous_month, previous_patients, current_month, department):
+        """Build a dataset row from a prediction request"""
+        return {
             'Month': current_month,
             'Department': department,
             'Number': previous_patients
         }
+
+    def add_new_data(self, previous_month, previous_patients, current_month, department):
+        """Add new data point to the existing dataset"""
+        # Prepare new data point
+        new_data = self.new_row(previous_month, previous_patients, current_month, department)
         
         # Append new data to the dataframe
         new_df = pd.DataFrame([new_data])
         self.df = pd.concat([self.df, new_df], ignore_index=True)
         
         # Retrain with updated dataset
-        self.save_dataset()
+        self.save_dataset([new_data])
         self.preprocess_data()
         self.train_model()
         
@@ -83,15 +93,18 @@ class PatientPredictor:
         
         return int(predicted_patients[0])
     
-    def save_dataset(self, filename='patient_predicts_evolve.csv'):
-        """Save updated dataset"""
-        self.df.to_csv(filename, index=False)
+    def save_dataset(self, rows):
+        """Append new rows to the dataset log"""
+        self.dataset.append(rows)
 
 # Global predictor initialization
 patient_predictor = PatientPredictor()
 patient_predictor.preprocess_data()
 patient_predictor.train_model()
 
+# New rows are applied by a background retrain; requests serve from the current snapshot
+patient_retrainer = RetrainWorker(patient_predictor)
+
 app = Flask(__name__)
 
 @app.route('/patient_prediction', methods=['POST'])
@@ -105,18 +118,22 @@ def predict_patient():
         current_month = data['current_month']
         department = data['department']
         
-        # Add new data and retrain model
-        patient_predictor.add_new_data(previous_month, previous_patients, current_month, department)
+        # Serve from one snapshot even if a retrain swaps in a new model meanwhile
+        predictor = patient_retrainer.current
+
+        # Queue new data for the background retrain
+        patient_retrainer.submit(predictor.new_row(previous_month, previous_patients, current_month, department))
         
         # Predict patients
-        predicted_patients = patient_predictor.predict(current_month, department)
+        predicted_patients = predictor.predict(current_month, department)
         
         return jsonify({
             'predicted_patients': predicted_patients,
             'previous_month': previous_month,
             'current_month': current_month,
             'department': department,
-            'message': 'Model retrained with new data'
+            'model_version': predictor.version,
+            'message': 'New data queued for retraining'
         })
 
     except Exception as e:
@@ -0,0 +1,111 @@
+import os
+import glob
+import json
+import time
+import pickle
+import hashlib
+import sklearn
+import pandas as pd
+
+
+def dataset_fingerprint(df):
+    """Content hash of a raw training frame, independent of its index"""
+    return RunningFingerprint(df).hexdigest()
+
+
+class RunningFingerprint:
+    """dataset_fingerprint of a frame that only grows; appended rows are hashed without rehashing the rest"""
+
+    def __init__(self, df, digest=None):
+        # Appended rows must keep these columns and dtypes, as they do in the concatenated frame
+        self.template = df.iloc[:0].copy()
+        if digest is None:
+            digest = hashlib.sha256()
+            digest.update(','.join(map(str, df.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        self._digest = digest
+
+    def extended(self, rows):
+        """Fingerprint with rows (a frame) appended; ValueError if they would change the columns or dtypes"""
+        frame = pd.concat([self.template, rows], ignore_index=True)
+        if list(frame.columns) != list(self.template.columns) or not frame.dtypes.equals(self.template.dtypes):
+            raise ValueError("Appended rows change the dataset's columns or dtypes")
+        # Row hashes don't depend on neighbouring rows, so hashing just the new ones continues the digest
+        digest = self._digest.copy()
+        digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+        return RunningFingerprint(self.template, digest)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+class ArtifactStore:
+    """Fitted predictor state on disk, keyed by the fingerprint of the data it was trained on"""
+
+    def __init__(self, directory='model_artifacts', keep=5, trainer=None):
+        self.directory = directory
+        self.keep = keep
+        # Called to fit a predictor on a cache miss; defaults to fitting in this process
+        self.trainer = trainer
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, predictor):
+        # Code and library versions are part of the key so stale pickles are never reused,
+        # and so are tuned model parameters, so a new search's fit never loads the old one
+        key = f'{predictor.data_fingerprint}:{predictor.ARTIFACT_VERSION}:{sklearn.__version__}'
+        if getattr(predictor, 'model_params', None):
+            key += ':' + json.dumps(predictor.model_params, sort_keys=True)
+        # Likewise a bounded training set fits different rows than the whole dataset
+        if getattr(predictor, 'training_policy', None) is not None:
+            key += f':{predictor.training_policy}'
+        key = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f'{type(predictor).__name__}-{key}.pkl')
+
+    def load(self, predictor):
+        """Restore fitted attributes onto predictor; False if there is no matching artifact"""
+        path = self.path(predictor)
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable artifact {path}: {e}")
+            return False
+
+        # Same data should give the same column layout; anything else means a stale artifact
+        if state.pop('feature_columns') != predictor.feature_columns:
+            return False
+        for name, value in state.items():
+            setattr(predictor, name, value)
+        return True
+
+    def save(self, predictor):
+        """Write predictor's fitted attributes atomically, then prune old artifacts"""
+        state = {name: getattr(predictor, name) for name in predictor.ARTIFACT_ATTRIBUTES}
+        state['feature_columns'] = predictor.feature_columns
+
+        path = self.path(predictor)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+        # Keep only the most recent artifacts for this predictor
+        pattern = os.path.join(self.directory, f'{type(predictor).__name__}-*.pkl')
+        for old_path in sorted(glob.glob(pattern), key=os.path.getmtime)[:-self.keep]:
+            os.remove(old_path)
+
+    def load_or_train(self, predictor):
+        """Load the artifact for predictor's current data, training and saving one if missing"""
+        start = time.perf_counter()
+        if self.load(predictor):
+            source = 'loaded artifact'
+        else:
+            if self.trainer is not None:
+                self.trainer(predictor)
+            else:
+                predictor.train_model()
+            self.save(predictor)
+            source = 'trained'
+        print(f"{type(predictor).__name__} {source} for data {predictor.data_fingerprint[:12]} "
+              f"in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,307 @@
+# Asyncio front-end for /opd_priority and /bed_priority with request micro-batching.
+#
+# Requests that arrive within a short window (or until a batch is full) are coalesced
+# into one stage_one / stage_two predict call, and each caller gets its own row back.
+# A full queue answers 503 with Retry-After instead of queueing without bound. Same
+# request and response JSON as the Flask handlers; the other endpoints stay in app.py.
+#
+#     python async_priority.py serve --port 5001 --window-ms 2 --max-batch 64
+#     python async_priority.py bench
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Only the priority models are needed here; don't warm up the forecasting predictors
+os.environ.setdefault('LAZY_WARM_UP', '0')
+
+import app
+from opd_lookup import OPDLookupTable
+
+STATUS_TEXT = {200: 'OK', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+
+class MicroBatcher:
+    """Coalesces rows submitted within max_delay seconds (at most max_batch) into one predict call"""
+
+    def __init__(self, predict_batch, max_batch=64, max_delay=0.002, max_queue=1024):
+        self.predict_batch = predict_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue(max_queue)
+        # One thread per model keeps the event loop accepting while a batch is scored
+        self.executor = ThreadPoolExecutor(1)
+        self.stats = collections.Counter()
+
+    def submit(self, record):
+        """Future for one record's result; raises asyncio.QueueFull when the queue is at capacity"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((record, future))
+        return future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+
+            # Take what is already queued, then wait out the rest of the window for more
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            records = [record for record, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.predict_batch, records)
+            except Exception as e:
+                results = [{'error': str(e)}] * len(batch)
+            self.stats['batches'] += 1
+            self.stats['rows'] += len(batch)
+
+            for (_, future), result in zip(batch, results):
+                # The caller may have disconnected in the meantime
+                if not future.done():
+                    future.set_result(result)
+
+
+def score_batch(resource, feature_names):
+    """Batch predict function for a priority model, same results as its single-row Flask handler"""
+    def predict(records):
+        results = [None] * len(records)
+        features, patient_ratings, valid_rows = app.build_feature_matrix(records, feature_names, results)
+        if valid_rows:
+            priorities = app.adjust_priorities(resource.get().predict(features), patient_ratings)
+            for index, priority in zip(valid_rows, priorities.tolist()):
+                results[index] = {'priority': priority}
+        return results
+    return predict
+
+
+class PriorityServer:
+    """Minimal HTTP/1.1 server (keep-alive, Content-Length bodies) for the two priority endpoints"""
+
+    def __init__(self, max_batch=64, window_ms=2.0, max_queue=1024):
+        self.batchers = {
+            '/opd_priority': MicroBatcher(score_batch(app.stage_one, app.OPD_FEATURES),
+                                          max_batch, window_ms / 1000, max_queue),
+            '/bed_priority': MicroBatcher(score_batch(app.stage_two, app.BED_FEATURES),
+                                          max_batch, window_ms / 1000, max_queue),
+        }
+
+    async def serve(self, host, port):
+        # Load both models before accepting traffic. One that fails is retried by each
+        # batch, which answers {'error': ...} per request as the Flask handlers do
+        for resource in (app.stage_one, app.stage_two):
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, resource.get)
+            except Exception as e:
+                print(f"Loading {resource.name} failed: {e}")
+        for batcher in self.batchers.values():
+            asyncio.create_task(batcher.run())
+
+        server = await asyncio.start_server(self.handle, host, port, backlog=512)
+        print(f"Async priority server on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def route(self, method, path, body):
+        """(status, payload, extra headers) for one request"""
+        if path == '/healthz':
+            return 200, {'status': 'ok'}, {}
+        if path == '/batching':
+            return 200, {endpoint[1:]: dict(batcher.stats) for endpoint, batcher in self.batchers.items()}, {}
+        batcher = self.batchers.get(path)
+        if batcher is None:
+            return 404, {'error': 'Not found'}, {}
+        if method != 'POST':
+            return 405, {'error': 'Method not allowed'}, {}
+
+        try:
+            record = json.loads(body)
+        except Exception as e:
+            return 200, {'error': str(e)}, {}
+
+        # On-grid OPD requests are answered from the precomputed table without batching; a
+        # model that isn't loaded is left to the batch, off the event loop
+        model = app.stage_one.get() if path == '/opd_priority' and app.stage_one.ready else None
+        if isinstance(model, OPDLookupTable):
+            try:
+                features = np.array([record[name] for name in app.OPD_FEATURES], dtype=np.float32)
+                priority = model.lookup(features, int(record['patient_rating']))
+                if priority is not None:
+                    return 200, {'priority': priority}, {}
+            except Exception:
+                pass
+
+        try:
+            future = batcher.submit(record)
+        except asyncio.QueueFull:
+            return 503, {'error': 'Server busy, retry shortly'}, {'Retry-After': '1'}
+        return 200, await future, {}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload, extra_headers = await self.route(method, path.split('?', 1)[0], body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                data = json.dumps(payload).encode()
+                head = [f'HTTP/1.1 {status} {STATUS_TEXT[status]}', 'Content-Type: application/json',
+                        f'Content-Length: {len(data)}', f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head += [f'{name}: {value}' for name, value in extra_headers.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _drive(port, path, body, connections, requests):
+    """Closed-loop clients on keep-alive connections; returns per-request latencies in seconds"""
+    latencies = []
+    status_counts = collections.Counter()
+    payload = json.dumps(body).encode()
+    request = (f'POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+               f'Content-Length: {len(payload)}\r\n\r\n').encode() + payload
+
+    async def client(count):
+        connection = None
+        for _ in range(count):
+            start = time.perf_counter()
+            # Reconnect whenever the server closed the previous connection
+            if connection is None:
+                connection = await asyncio.open_connection('127.0.0.1', port)
+            reader, writer = connection
+            writer.write(request)
+            status = int((await reader.readline()).split()[1])
+            length, close = 0, False
+            while True:
+                line = (await reader.readline()).lower()
+                if line in (b'\r\n', b''):
+                    break
+                if line.startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+                elif line.startswith(b'connection:') and b'close' in line:
+                    close = True
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            status_counts[status] += 1
+            if close:
+                writer.close()
+                connection = None
+        if connection is not None:
+            connection[1].close()
+
+    await asyncio.gather(*(client(requests // connections) for _ in range(connections)))
+    return latencies, status_counts
+
+
+def bench(port=5097, requests=4000, concurrency=(1, 16, 64), window_ms=2.0, max_batch=64):
+    """Throughput and latency of the Flask handlers against this server, per endpoint and concurrency"""
+    import subprocess
+    import urllib.request
+
+    bodies = {
+        '/opd_priority': {'illness_severity': 3, 'age': 40, 'transmittable': 1, 'disabled': 0,
+                          'patient_rating': 4},
+        '/bed_priority': {'illness_severity': 4, 'doctor_offset': 2, 'age': 70, 'waiting_period': 3,
+                          'transmittable': 0, 'disabled': 1, 'patient_rating': 3},
+    }
+    servers = {
+        'flask': [sys.executable, '-c', f'import app; app.app.run(port={port}, threaded=True)'],
+        'async': [sys.executable, __file__, 'serve', '--port', str(port),
+                  '--window-ms', str(window_ms), '--max-batch', str(max_batch)],
+    }
+
+    print(f"{'server':>6} {'endpoint':>13} {'conns':>5} {'req/s':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}")
+    for name, command in servers.items():
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                  env=dict(os.environ, LAZY_WARM_UP='0'))
+        try:
+            deadline = time.monotonic() + 120
+            while True:
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/healthz', timeout=1)
+                    break
+                except Exception:
+                    if time.monotonic() > deadline or server.poll() is not None:
+                        raise RuntimeError(f"{name} server did not start")
+                    time.sleep(0.3)
+
+            for path, body in bodies.items():
+                # Untimed warm-up loads the model behind the endpoint
+                asyncio.run(_drive(port, path, body, 1, 20))
+                for connections in concurrency:
+                    start = time.perf_counter()
+                    latencies, statuses = asyncio.run(_drive(port, path, body, connections, requests))
+                    elapsed = time.perf_counter() - start
+                    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+                    busy = f'  ({statuses[503]} x 503)' if statuses[503] else ''
+                    print(f"{name:>6} {path:>13} {connections:>5} {len(latencies) / elapsed:>7.0f} "
+                          f"{p50:>7.2f} {p95:>7.2f} {p99:>7.2f}{busy}")
+
+            if name == 'async':
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/batching') as response:
+                    for endpoint, stats in json.load(response).items():
+                        print(f"       {endpoint}: {stats['rows']} rows in {stats['batches']} batches "
+                              f"(mean {stats['rows'] / stats['batches']:.1f} rows per predict)")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Asyncio micro-batching front-end for the priority models')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='run the async priority server')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=5001)
+    serve_parser.add_argument('--window-ms', type=float, default=2.0, help='how long a batch waits for more rows')
+    serve_parser.add_argument('--max-batch', type=int, default=64, help='rows per predict call at most')
+    serve_parser.add_argument('--max-queue', type=int, default=1024, help='queued rows before answering 503')
+    bench_parser = commands.add_parser('bench', help='compare against the Flask handlers')
+    bench_parser.add_argument('--requests', type=int, default=4000)
+    bench_parser.add_argument('--concurrency', default='1,16,64', help='comma-separated connection counts')
+    bench_parser.add_argument('--window-ms', type=float, default=2.0)
+    bench_parser.add_argument('--max-batch', type=int, default=64)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = PriorityServer(args.max_batch, args.window_ms, args.max_queue)
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        bench(requests=args.requests, concurrency=[int(count) for count in args.concurrency.split(',')],
+              window_ms=args.window_ms, max_batch=args.max_batch)
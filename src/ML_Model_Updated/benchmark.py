@@ -0,0 +1,180 @@
+# Microbenchmarks for the ML endpoints and the forecasting predictor methods.
+#
+#     python benchmark.py                              # run, write benchmark_results.json
+#     python benchmark.py --save-baseline              # record benchmark_baseline.json
+#     python benchmark.py --baseline benchmark_baseline.json   # exit 1 on a regression
+#
+# Everything runs in a scratch copy of this directory, so add_new_data and the
+# endpoints that queue new rows never touch the real datasets or model artifacts.
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+
+OPD_REQUEST = {'illness_severity': 3, 'age': 40, 'transmittable': 1, 'disabled': 0, 'patient_rating': 4}
+BED_REQUEST = {'illness_severity': 4, 'doctor_offset': 2, 'age': 70, 'waiting_period': 3,
+               'transmittable': 0, 'disabled': 1, 'patient_rating': 3}
+
+
+def measure(function, max_iterations=2000, budget_seconds=2.0, warmup=5):
+    """Latency percentiles (ms) and throughput of repeated calls, within an iteration and time budget"""
+    for _ in range(warmup):
+        function()
+
+    timings = []
+    deadline = time.perf_counter() + budget_seconds
+    while len(timings) < max_iterations and (len(timings) < 5 or time.perf_counter() < deadline):
+        start = time.perf_counter_ns()
+        function()
+        timings.append(time.perf_counter_ns() - start)
+
+    timings = np.array(timings) / 1e6
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        'iterations': len(timings),
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'ops_per_sec': float(1000 / timings.mean())
+    }
+
+
+def cases():
+    """(name, function, max_iterations) for every benchmark; imports happen in the scratch directory"""
+    import app
+    from forecasting import PatientPredictor, RequirementPredictor
+
+    client = app.app.test_client()
+
+    # Endpoints queue rows for background retrains, which are off the request path;
+    # park them so a retrain doesn't land in the middle of a later benchmark
+    for resource in app.FORECASTING_RESOURCES.values():
+        retrainer = resource.get()
+        retrainer.debounce_seconds = retrainer.max_wait_seconds = 24 * 3600
+
+    def post(path, body):
+        def call():
+            response = client.post(path, json=body)
+            assert response.status_code == 200 and 'error' not in response.get_json(), response.get_data()
+        return call
+
+    yield 'endpoint.opd_priority', post('/opd_priority', OPD_REQUEST), 2000
+    if os.path.exists('medical_priority_predictor.pkl'):
+        yield 'endpoint.bed_priority', post('/bed_priority', BED_REQUEST), 2000
+    yield 'endpoint.patient_prediction', post(
+        '/patient_prediction', {'current_month': 'March', 'department': 'ENT'}), 2000
+    yield 'endpoint.drugs_inventory_pred', post(
+        '/drugs_inventory_pred',
+        {'previous_month': 'February', 'previous_amount': 1200, 'current_month': 'March',
+         'item': app.requirement_retrainer.get().current.snapshot.label_encoder.classes_[0]}), 2000
+
+    patient = PatientPredictor()
+    patient.preprocess_data()
+    patient.train_model()
+    department = patient.snapshot.departments[0]
+    yield 'PatientPredictor.predict', lambda: patient.predict('March', department), 5000
+    yield 'PatientPredictor.add_new_data', lambda: patient.add_new_data('February', 900, 'March', department), 20
+    yield 'PatientPredictor.train_model', patient.train_model, 20
+
+    requirement = RequirementPredictor()
+    requirement.preprocess_data()
+    requirement.train_model()
+    item = requirement.snapshot.label_encoder.classes_[0]
+    yield 'RequirementPredictor.predict', lambda: requirement.predict('February', 1200, 'March', item), 2000
+    yield 'RequirementPredictor.add_new_data', lambda: requirement.add_new_data('February', 1200, 'March', item), 20
+    yield 'RequirementPredictor.train_model', requirement.train_model, 20
+
+
+def run(selected=None, budget_seconds=2.0):
+    """Run the benchmarks in a scratch copy of this directory and return the results document"""
+    source = os.path.dirname(os.path.abspath(__file__))
+    scratch = tempfile.mkdtemp(prefix='ml-benchmark-')
+    for path in glob.glob(os.path.join(source, '*.csv')) + glob.glob(os.path.join(source, '*.pkl')):
+        shutil.copy(path, scratch)
+
+    # Models load on first request inside the timed warm-up, not in background threads
+    os.environ['LAZY_WARM_UP'] = '0'
+    previous_directory = os.getcwd()
+    os.chdir(scratch)
+    sys.path.insert(0, source)
+    results = {}
+    try:
+        for name, function, max_iterations in cases():
+            if selected and not any(pattern in name for pattern in selected):
+                continue
+            results[name] = measure(function, max_iterations, budget_seconds)
+            print(f"{name:<36} p50 {results[name]['p50_ms']:9.3f} ms  p95 {results[name]['p95_ms']:9.3f} ms  "
+                  f"p99 {results[name]['p99_ms']:9.3f} ms  {results[name]['ops_per_sec']:10.1f} ops/s")
+    finally:
+        os.chdir(previous_directory)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    import sklearn
+    return {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+        },
+        'results': results
+    }
+
+
+def compare(results, baseline, max_p50_ratio=1.25, max_p99_ratio=1.5):
+    """Regressions of results against baseline, as printable strings"""
+    regressions = []
+    print(f"\n{'benchmark':<36} {'p50 vs baseline':>16} {'p99 vs baseline':>16}")
+    for name, current in results['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            print(f"{name:<36} {'(new)':>16}")
+            continue
+        p50_ratio = current['p50_ms'] / reference['p50_ms']
+        p99_ratio = current['p99_ms'] / reference['p99_ms']
+        flags = []
+        if p50_ratio > max_p50_ratio:
+            flags.append(f'p50 {p50_ratio:.2f}x > {max_p50_ratio}x')
+        if p99_ratio > max_p99_ratio:
+            flags.append(f'p99 {p99_ratio:.2f}x > {max_p99_ratio}x')
+        print(f"{name:<36} {p50_ratio:>15.2f}x {p99_ratio:>15.2f}x  {'REGRESSION' if flags else ''}")
+        regressions += [f'{name}: {flag}' for flag in flags]
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the ML endpoints and predictors')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the results JSON')
+    parser.add_argument('--baseline', help='baseline JSON to compare against; exit 1 on a regression')
+    parser.add_argument('--save-baseline', nargs='?', const='benchmark_baseline.json',
+                        help='also write the results as the new baseline')
+    parser.add_argument('--max-p50-ratio', type=float, default=1.25, help='allowed p50 slowdown vs baseline')
+    parser.add_argument('--max-p99-ratio', type=float, default=1.5, help='allowed p99 slowdown vs baseline')
+    parser.add_argument('--budget', type=float, default=2.0, help='seconds per benchmark at most')
+    parser.add_argument('only', nargs='*', help='run only benchmarks whose name contains one of these')
+    args = parser.parse_args()
+
+    results = run(args.only, args.budget)
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_p50_ratio, args.max_p99_ratio)
+        if regressions:
+            print(f"\n{len(regressions)} regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions")
@@ -0,0 +1,278 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from column_store import STRING_DTYPE
+
+
+class GrowableArray:
+    """Append-only NumPy array that doubles its capacity, so appends are amortized O(1)
+
+    Slices handed out earlier stay valid: appends only write past the current size,
+    and growing copies into a new buffer while old slices keep the old one.
+    """
+
+    def __init__(self, dtype, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def accepts(self, values):
+        """Whether values fit this column's dtype without losing information"""
+        return np.can_cast(np.asarray(values).dtype, self._data.dtype, 'same_kind')
+
+    def extend(self, values):
+        values = np.asarray(values)
+        end = self.size + len(values)
+        if end > len(self._data):
+            grown = np.empty(max(end, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:end] = values
+        self.size = end
+
+    def view(self, size):
+        return self._data[:size]
+
+    def __getstate__(self):
+        # Don't ship unused capacity to a training process
+        return {'_data': self._data[:self.size].copy(), 'size': self.size}
+
+
+class Vocabulary:
+    """Codes for a text column in first-seen order, so a new value never recodes earlier rows"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self._ranks = (0, None)
+
+    def encode(self, series):
+        """Codes of series' values, adding unseen ones; missing values get -1"""
+        codes, uniques = pd.factorize(series)
+        mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+        for index, value in enumerate(uniques):
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            mapping[index] = code
+        # factorize marks missing values -1, which picks the trailing slot
+        mapping[-1] = -1
+        return mapping[codes]
+
+    def ranks(self, size):
+        """Position of each of the first size values in sorted order, as get_dummies and LabelEncoder sort"""
+        if self._ranks[0] != size:
+            ranks = np.empty(size, dtype=np.int32)
+            ranks[sorted(range(size), key=self.values.__getitem__)] = np.arange(size)
+            self._ranks = (size, ranks)
+        return self._ranks[1]
+
+
+class FeatureStore:
+    """A dataset's columns as growable arrays, with text columns coded by a Vocabulary
+
+    Appending rows costs the same however long the history is; derived features
+    (one-hot columns, label codes, lags) are built from the arrays only when a
+    predictor trains. Each predictor holds a FeatureView of the rows that existed
+    when it was prepared, so a retrain candidate can append while the serving
+    predictor keeps reading its own, shorter view.
+    """
+
+    def __init__(self, text_columns, numeric_columns):
+        self.vocabularies = {name: Vocabulary() for name in text_columns}
+        self.columns = {name: GrowableArray(np.int32) for name in text_columns}
+        self.columns.update({name: GrowableArray(dtype) for name, dtype in numeric_columns.items()})
+        self.rows = 0
+
+    @property
+    def nbytes(self):
+        return sum(column._data.nbytes for column in self.columns.values())
+
+    def extend(self, frame):
+        """Append a frame's rows (other columns are ignored); returns the view including them"""
+        # Check every numeric column first, so a rejected append leaves the store as it was
+        numeric = {name: frame[name].to_numpy() for name in self.columns if name not in self.vocabularies}
+        for name, values in numeric.items():
+            if not self.columns[name].accepts(values):
+                raise TypeError(f"Can't append {values.dtype} values to the {name} column")
+
+        for name, vocabulary in self.vocabularies.items():
+            self.columns[name].extend(vocabulary.encode(frame[name]))
+        for name, values in numeric.items():
+            self.columns[name].extend(values)
+        self.rows += len(frame)
+        return self.view()
+
+    def view(self):
+        return FeatureView(self, self.rows, {name: len(vocabulary.values)
+                                             for name, vocabulary in self.vocabularies.items()})
+
+
+class LatestIndex:
+    """Latest state per key (an item) of a dataset that only grows, updated in O(1) per row
+
+    Each entry holds the key's last month and amount, its row count and mean amount, and
+    its last `window` amounts for a rolling mean. An update replaces the key's entry in one
+    assignment, so a concurrent reader sees either the old entry or the new one.
+    """
+
+    def __init__(self, window=3, entries=None):
+        self.window = window
+        # key -> entry, in order of first appearance
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def build(cls, keys, months, amounts, window=3):
+        """Index of whole columns in one vectorized pass"""
+        frame = pd.DataFrame({'key': keys, 'month': months, 'amount': amounts})
+        groups = frame.groupby('key', sort=False)
+        last = groups.last()
+        stats = groups['amount'].agg(['count', 'mean'])
+        recent = frame.groupby('key', sort=False).tail(window).groupby('key', sort=False)['amount'].agg(list)
+        return cls(window, {
+            key: {
+                'last_month': last.at[key, 'month'],
+                'last_amount': float(last.at[key, 'amount']),
+                'count': int(stats.at[key, 'count']),
+                'mean': float(stats.at[key, 'mean']),
+                'recent': [float(amount) for amount in recent[key]],
+            }
+            for key in last.index
+        })
+
+    def get(self, key):
+        """The key's entry with its rolling_mean, or None if the key has no rows"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return dict(entry, rolling_mean=sum(entry['recent']) / len(entry['recent']))
+
+    def last_amount(self, key):
+        entry = self.entries.get(key)
+        return entry['last_amount'] if entry is not None else np.nan
+
+    def update(self, key, month, amount):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = {'last_month': month, 'last_amount': amount, 'count': 1,
+                                 'mean': amount, 'recent': [amount]}
+            return
+        count = entry['count'] + 1
+        self.entries[key] = {
+            'last_month': month,
+            'last_amount': amount,
+            'count': count,
+            'mean': entry['mean'] + (amount - entry['mean']) / count,
+            'recent': (entry['recent'] + [amount])[-self.window:],
+        }
+
+    def save(self, path, fingerprint):
+        """Write the index next to its dataset, tagged with the dataset fingerprint it reflects"""
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'window': self.window, 'entries': self.entries}, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """The saved index if it reflects the dataset with this fingerprint, otherwise None"""
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get('fingerprint') != fingerprint:
+            return None
+        return cls(saved['window'], saved['entries'])
+
+
+class FeatureView:
+    """The first rows of a FeatureStore, with the vocabulary those rows use"""
+
+    def __init__(self, store, rows, vocabulary_sizes):
+        self.store = store
+        self.rows = rows
+        self.vocabulary_sizes = vocabulary_sizes
+        # Frames built from this view; the view never changes, so neither do they
+        self._derived = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __getstate__(self):
+        # Whoever unpickles a view rebuilds the frames it needs
+        return {**self.__dict__, '_derived': {}}
+
+    def derived(self, name, build):
+        """build(self), built once per view and kept under name"""
+        value = self._derived.get(name)
+        if value is None:
+            value = self._derived[name] = build(self)
+        return value
+
+    def values(self, name):
+        """Numeric column, or text column codes"""
+        return self.store.columns[name].view(self.rows)
+
+    def categories(self, name):
+        """Text values of the column, in first-seen order"""
+        return self.store.vocabularies[name].values[:self.vocabulary_sizes[name]]
+
+    def sorted_codes(self, name, codes=None):
+        """Codes of the column (or of codes from it) in sorted-value order, with the sorted values; missing values stay -1"""
+        size = self.vocabulary_sizes[name]
+        ranks = np.append(self.store.vocabularies[name].ranks(size), -1)
+        return ranks[self.values(name) if codes is None else codes], sorted(self.categories(name))
+
+    def mapped(self, name, mapping, codes=None):
+        """Float column of mapping[value] for a text column (or codes from it); NaN where the value isn't in mapping"""
+        lookup = np.array([mapping.get(value, np.nan) for value in self.categories(name)] + [np.nan])
+        return lookup[self.values(name) if codes is None else codes]
+
+    def decode(self, name, codes):
+        """Text values of codes from a text column"""
+        return np.array(self.categories(name) + [np.nan], dtype=object)[codes]
+
+    def text(self, name, start=0):
+        """Text values of rows start onwards"""
+        return self.decode(name, self.values(name)[start:])
+
+    def text_series(self, name):
+        categories = self.categories(name)
+        return pd.Series(pd.Categorical.from_codes(self.values(name), categories)).astype(STRING_DTYPE)
+
+
+def bench(sizes=(10_000, 100_000, 1_000_000), appends=20):
+    """Per-row cost of append_data against a full preprocess_data, at growing history lengths"""
+    import time
+    import shutil
+    import tempfile
+    from forecasting import RequirementPredictor, synthetic_requirements
+
+    rng = np.random.default_rng(0)
+    print(f"{'history':>10} {'preprocess ms':>14} {'append ms/row':>14}")
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix='feature-store-bench-')
+        try:
+            csv_path = f'{directory}/drugs.csv'
+            synthetic_requirements(size, rng).to_csv(csv_path, index=False)
+            predictor = RequirementPredictor(csv_path)
+
+            start = time.perf_counter()
+            predictor.preprocess_data()
+            preprocess = time.perf_counter() - start
+
+            rows = [{'Month_name': 'May', 'Item_name': f'Item {index % 40}', 'Amount': 500.0}
+                    for index in range(appends)]
+            start = time.perf_counter()
+            for row in rows:
+                predictor.append_data([row])
+            append = (time.perf_counter() - start) / appends
+            print(f"{size:>10,} {preprocess * 1000:>14.1f} {append * 1000:>14.2f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # Append cost benchmark: python feature_store.py
+    bench()
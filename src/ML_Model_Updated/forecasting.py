@@ -0,0 +1,789 @@
+import os
+import threading
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sklearn.impute import SimpleImputer
+from sklearn.ensemble import RandomForestRegressor
+from column_store import open_dataset
+from feature_store import FeatureStore, LatestIndex
+from training_set import training_columns, held_out
+from artifact_store import RunningFingerprint
+from timing import span
+
+# Month order for consistency
+MONTH_ORDER = [
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+]
+MONTH_NUMERIC = {month: index for index, month in enumerate(MONTH_ORDER, 1)}
+
+# Everything predict reads, fitted together. Training builds a new snapshot and publishes it
+# with one assignment, so a concurrent predict never pairs a new scaler with an old model
+PatientModel = namedtuple('PatientModel', [
+    'columns', 'scaler', 'model', 'departments', 'department_index', 'prediction_matrix', 'holdout'
+])
+RequirementModel = namedtuple('RequirementModel', [
+    'columns', 'label_encoder', 'imputer', 'scaler', 'model',
+    'item_codes', 'imputer_medians', 'scaler_mean', 'scaler_scale', 'holdout'
+])
+
+class PatientPredictor:
+    # Fitted state persisted by ArtifactStore; bump ARTIFACT_VERSION when training changes
+    ARTIFACT_VERSION = 4
+    ARTIFACT_ATTRIBUTES = ['snapshot', 'training_size']
+
+    # Tree-building threads for train_model; set per fit by TrainingOrchestrator
+    n_jobs = None
+
+    # Forest parameters until HyperparameterTuner sets tuned model_params, and what it searches
+    MODEL_PARAMS = {'n_estimators': 100}
+    SEARCH_SPACE = {
+        'n_estimators': [50, 100, 200, 300],
+        'max_depth': [None, 5, 10, 20],
+        'min_samples_split': [2, 5, 10],
+        'max_features': [1.0, 0.5, 'sqrt'],
+    }
+    model_params = None
+
+    # Rows train_model sees, from a training_set.TrainingPolicy (None trains on every row),
+    # and how many training rows the last fit had
+    training_policy = None
+    training_size = None
+
+    # Dataset file name, in the working directory or a hospital's data directory
+    DATASET_FILE = 'patient predicts evolve updated.csv'
+
+    def __init__(self, csv_path=DATASET_FILE):
+        self.csv_path = csv_path
+        self.snapshot = None
+        self.features = None
+        self.version = 1
+
+        # Appends go to a row log in front of the CSV (or its imported columnar copy)
+        self.dataset = open_dataset(csv_path)
+
+        # Serializes writers (add_new_data and background retrains); predict never takes it
+        self.write_lock = threading.Lock()
+
+    def preprocess_data(self):
+        """Preprocess the dataset for model training"""
+        # Load the dataset, replaying rows still in the log
+        with span('load_dataset'):
+            df = self.dataset.load()
+            fingerprint = RunningFingerprint(df)
+
+        # Code the columns once into growable arrays; append_data extends them row by row
+        with span('encode'):
+            store = FeatureStore(['Month', 'Department'], {'Number': df['Number'].dtype})
+            features = store.extend(df)
+        self.use_features(features, fingerprint)
+
+    def append_data(self, rows):
+        """Extend the preprocessed data with rows already saved; False if they need preprocess_data"""
+        features = self.features
+        # Only the newest view can grow (a failed retrain may have appended past this one)
+        if features is None or len(features) != features.store.rows:
+            return False
+        frame = pd.DataFrame(rows)
+        try:
+            fingerprint = self._fingerprint.extended(frame)
+            features = features.store.extend(frame)
+        except (ValueError, TypeError, KeyError):
+            return False
+        self.use_features(features, fingerprint)
+        return True
+
+    def use_features(self, features, fingerprint):
+        """Switch to a view of the preprocessed data and the fingerprint of the raw rows behind it"""
+        self._fingerprint = fingerprint
+        self.data_fingerprint = fingerprint.hexdigest()
+        # Picked here, in the serving process, where a sampling policy keeps its reservoir
+        self.training_index = self.training_policy.select(len(features)) if self.training_policy else None
+        self.features = features
+
+    @property
+    def feature_columns(self):
+        """Columns of X: Month_Numeric then one Dept_ column per department, sorted like get_dummies"""
+        _, departments = self.features.sorted_codes('Department')
+        return ['Month_Numeric'] + [f'Dept_{department}' for department in departments]
+
+    @property
+    def df(self):
+        """Raw training rows with Month_Numeric, built from the feature arrays on first use"""
+        if self.features is None:
+            return None
+        return self.features.derived('df', lambda features: pd.DataFrame({
+            'Month': features.text_series('Month'),
+            'Department': features.text_series('Department'),
+            'Number': features.values('Number'),
+            'Month_Numeric': features.mapped('Month', MONTH_NUMERIC)
+        }))
+
+    @property
+    def training(self):
+        """Coded columns of the rows training_policy picks, their sample weights, and the held-out columns"""
+        return self.features.derived('training', lambda features: training_columns(
+            features, self.training_policy, self.training_index, ['Month', 'Department'], ['Number']))
+
+    @property
+    def X(self):
+        return self.features.derived('X', self._build_X)
+
+    @property
+    def y(self):
+        return self.features.derived('y', lambda features: pd.Series(self.training[0]['Number'], name='Number'))
+
+    @property
+    def sample_weight(self):
+        return self.training[1]
+
+    def _build_X(self, features):
+        # One-hot departments as get_dummies does; a missing department (-1) sets no column
+        columns = self.training[0]
+        codes, departments = features.sorted_codes('Department', columns['Department'])
+        X = {'Month_Numeric': features.mapped('Month', MONTH_NUMERIC, columns['Month'])}
+        for index, department in enumerate(departments):
+            X[f'Dept_{department}'] = codes == index
+        return pd.DataFrame(X)
+
+    def training_inputs(self):
+        """What a fit needs from the preprocessed data: X, y, sample weights and the held-out rows"""
+        # X and y leave out the held-out rows, kept in raw form for scoring this fit and its incremental updates
+        columns = self.training[2]
+        holdout = (
+            (self.features.mapped('Month', MONTH_NUMERIC, columns['Month']),
+             self.features.decode('Department', columns['Department']).tolist()),
+            columns['Number'].astype(float)
+        )
+        return {'X': self.X, 'y': self.y, 'sample_weight': self.sample_weight, 'holdout': holdout}
+
+    def train_model(self, inputs=None):
+        """Train the Random Forest Regressor, on training_inputs() unless given ones built elsewhere"""
+        inputs = inputs or self.training_inputs()
+        X, y = inputs['X'], inputs['y']
+        self.training_size = len(y)
+        
+        # Scale features
+        scaler = StandardScaler()
+        X_train_scaled = scaler.fit_transform(X)
+        
+        # Train model
+        model = RandomForestRegressor(**(self.model_params or self.MODEL_PARAMS), random_state=42, n_jobs=self.n_jobs)
+        with span('fit'):
+            model.fit(X_train_scaled, y, sample_weight=inputs['sample_weight'])
+
+        # Threads only pay off for the fit; single-row predicts stay sequential
+        model.set_params(n_jobs=None)
+
+        self.snapshot = self.build_snapshot(list(X.columns), scaler, model, inputs['holdout'])
+
+    def build_snapshot(self, columns, scaler, model, holdout):
+        """Bundle fitted state with predictions for every month x department combination"""
+        departments = [col[len('Dept_'):] for col in columns if col.startswith('Dept_')]
+        department_index = {department: index for index, department in enumerate(departments)}
+
+        # The input domain is tiny, so answer every future predict from one vectorized batch:
+        # one row per (month, department), plus a trailing all-zero column for unknown departments
+        n_columns = len(departments) + 1
+        grid = pd.DataFrame(0, index=range(len(MONTH_ORDER) * n_columns), columns=columns)
+        grid['Month_Numeric'] = np.repeat(np.arange(1, len(MONTH_ORDER) + 1), n_columns)
+        for index, department in enumerate(departments):
+            grid.loc[index::n_columns, f'Dept_{department}'] = 1
+
+        with span('prediction_matrix'):
+            predictions = model.predict(scaler.transform(grid))
+        prediction_matrix = predictions.astype(int).reshape(len(MONTH_ORDER), n_columns)
+        return PatientModel(columns, scaler, model, departments, department_index, prediction_matrix, holdout)
+
+    def replace_model(self, model):
+        """Publish an incrementally updated forest with the current fitted encoding"""
+        snapshot = self.snapshot
+        self.snapshot = self.build_snapshot(snapshot.columns, snapshot.scaler, model, snapshot.holdout)
+
+    def encode_rows(self, months, departments):
+        """Scaled feature rows for month numbers and departments; None if a department is new"""
+        snapshot = self.snapshot
+
+        # Columns are Month_Numeric followed by one Dept_ column per known department
+        X = np.zeros((len(departments), len(snapshot.departments) + 1))
+        X[:, 0] = months
+        for row, department in enumerate(departments):
+            index = snapshot.department_index.get(department)
+            if index is None:
+                return None
+            X[row, index + 1] = 1
+        return (X - snapshot.scaler.mean_) / snapshot.scaler.scale_
+
+    def learning_rows(self, rows):
+        """Scaled features and targets for new dataset rows outside the holdout; None if they need a full refit"""
+        months = [MONTH_NUMERIC.get(row['Month']) for row in rows]
+        if None in months:
+            return None
+        X = self.encode_rows(months, [row['Department'] for row in rows])
+        if X is None:
+            return None
+        # Called before append_data, so the rows go at the end of the store
+        train = ~held_out(np.arange(len(rows)) + self.features.store.rows)
+        return X[train], np.array([row['Number'] for row in rows], dtype=float)[train]
+
+    def recent_rows(self, window):
+        """Raw inputs and targets of the training rows among the last window rows"""
+        features = self.features
+        start = max(0, len(features) - window)
+        train = ~held_out(np.arange(start, len(features)))
+        months = np.array([MONTH_NUMERIC.get(month, np.nan) for month in features.text('Month', start)])
+        inputs = (months[train], features.text('Department', start)[train].tolist())
+        return inputs, features.values('Number')[start:][train].astype(float)
+        
+    def new_row(self, previous_month, previous_patients, current_month, department):
+        """Build a dataset row from a prediction request"""
+        return {
+            'Month': current_month,
+            'Department': department,
+            'Number': previous_patients
+        }
+
+    def add_new_data(self, previous_month, previous_patients, current_month, department):
+        """Add new data point to the existing dataset"""
+        # Prepare new data point
+        new_data = self.new_row(previous_month, previous_patients, current_month, department)
+        
+        # Retrain with updated dataset; one writer at a time, while predict keeps
+        # serving the previous snapshot until train_model swaps in the new one
+        with self.write_lock:
+            with span('save_dataset'):
+                self.save_dataset([new_data])
+            with span('preprocess'):
+                if not self.append_data([new_data]):
+                    self.preprocess_data()
+            with span('train'):
+                self.train_model()
+        
+    def predict(self, current_month, department):
+        """Predict patients for given month and department"""
+        snapshot = self.snapshot
+
+        # Unknown departments map to the all-zero column, like the one-hot encoding does
+        with span('lookup'):
+            month_index = MONTH_ORDER.index(current_month)
+            department_index = snapshot.department_index.get(department, len(snapshot.departments))
+            return int(snapshot.prediction_matrix[month_index, department_index])
+    
+    def save_dataset(self, rows):
+        """Append new rows to the dataset log"""
+        self.dataset.append(rows)
+
+
+class RequirementPredictor:
+    # Fitted state persisted by ArtifactStore; bump ARTIFACT_VERSION when training changes
+    ARTIFACT_VERSION = 6
+    ARTIFACT_ATTRIBUTES = ['snapshot', 'training_size']
+
+    # Tree-building threads for train_model; set per fit by TrainingOrchestrator
+    n_jobs = None
+
+    # Forest parameters until HyperparameterTuner sets tuned model_params, and what it searches
+    MODEL_PARAMS = {'n_estimators': 200, 'max_depth': 10, 'min_samples_split': 5}
+    SEARCH_SPACE = {
+        'n_estimators': [100, 200, 300],
+        'max_depth': [None, 5, 10, 20],
+        'min_samples_split': [2, 5, 10],
+        'min_samples_leaf': [1, 2, 4],
+        'max_features': [1.0, 0.5, 'sqrt'],
+    }
+    model_params = None
+
+    # Rows train_model sees, from a training_set.TrainingPolicy (None trains on every row),
+    # and how many training rows the last fit had
+    training_policy = None
+    training_size = None
+
+    # Dataset file name, in the working directory or a hospital's data directory
+    DATASET_FILE = 'New_dataset_drugs.csv'
+
+    def __init__(self, csv_path=DATASET_FILE):
+        self.csv_path = csv_path
+        self.snapshot = None
+        self.features = None
+        self.version = 1
+
+        # Latest state per item, kept beside the dataset so it survives restarts
+        self.item_index = None
+        self.item_index_path = csv_path + '.items.json'
+
+        # Ensure CSV exists
+        if not os.path.exists(csv_path):
+            self.create_initial_dataset()
+
+        # Appends go to a row log in front of the CSV (or its imported columnar copy)
+        self.dataset = open_dataset(csv_path)
+
+        # Per-thread input rows for the predict fast path
+        self._buffers = threading.local()
+
+        # Serializes writers (add_new_data and background retrains); predict never takes it
+        self.write_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Pickled copies (fit workers, prefork snapshots) leave the per-thread buffers behind
+        return {name: value for name, value in self.__dict__.items() if name != '_buffers'}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._buffers = threading.local()
+
+    def create_initial_dataset(self):
+        """Create an initial dataset if none exists"""
+        initial_data = {
+            'Month_name': ['January'] * 3,
+            'Item_name': ['Drug A', 'Drug B', 'Drug C'],
+            'Amount': [1000, 1500, 2000]
+        }
+        df = pd.DataFrame(initial_data)
+        df.to_csv(self.csv_path, index=False)
+        print(f"Created initial dataset at {self.csv_path}")
+
+    def preprocess_data(self):
+        """Comprehensive data preprocessing"""
+        # Load the dataset, replaying rows still in the log
+        with span('load_dataset'):
+            df = self.dataset.load()
+            fingerprint = RunningFingerprint(df)
+
+        # Code the usable rows once into growable arrays; append_data extends them row by row
+        with span('encode'):
+            rows = self.training_rows(df)
+            store = FeatureStore(['Month_name', 'Item_name'], {'Amount': float, 'Previous_Amount': float})
+            features = store.extend(rows)
+
+        # The saved item index is reused if it was written for exactly this data
+        with span('item_index'):
+            self.item_index = LatestIndex.load(self.item_index_path, fingerprint.hexdigest())
+            if self.item_index is None:
+                self.item_index = LatestIndex.build(rows['Item_name'], rows['Month_name'], rows['Amount'])
+                self.save_item_index(fingerprint.hexdigest())
+        self.use_features(features, fingerprint)
+
+    def training_rows(self, df, item_index=None):
+        """Rows of df with a usable Amount and each row's lag input
+
+        The lag input is the amount of the item's previous row: from df itself, or, for rows
+        appended after the ones item_index reflects, from the index.
+        """
+        # Ensure clean numeric data; the columnar store and logged rows already hold numbers
+        if pd.api.types.is_numeric_dtype(df['Amount']):
+            amount = df['Amount'].fillna(0)
+        else:
+            amount = pd.to_numeric(
+                df['Amount'].astype(str).str.replace(',', ''), 
+                errors='coerce'
+            ).fillna(0)
+
+        # Drop rows with 0 or NaN amounts
+        usable = amount > 0
+        rows = df.loc[usable, ['Month_name', 'Item_name']]
+        rows['Amount'] = amount[usable].astype(float)
+
+        # Lag feature: the item's previous amount. An item's first row has none; train_model
+        # imputes it like any missing input, and incremental updates do the same through encode_rows
+        if item_index is None:
+            rows['Previous_Amount'] = rows.groupby('Item_name', sort=False)['Amount'].shift(1)
+        else:
+            rows['Previous_Amount'] = self.previous_amounts(rows['Item_name'], rows['Amount'], item_index)
+        return rows
+
+    def previous_amounts(self, items, amounts, item_index):
+        """Lag input of new rows: each item's amount before it, from earlier new rows or item_index"""
+        latest = {}
+        previous_amounts = []
+        for item, amount in zip(items, amounts):
+            previous_amounts.append(latest[item] if item in latest else item_index.last_amount(item))
+            latest[item] = float(amount)
+        return previous_amounts
+
+    def append_data(self, rows):
+        """Extend the preprocessed data with rows already saved; False if they need preprocess_data"""
+        features = self.features
+        # Only the newest view can grow (a failed retrain may have appended past this one)
+        if features is None or len(features) != features.store.rows:
+            return False
+        frame = pd.DataFrame(rows)
+        try:
+            fingerprint = self._fingerprint.extended(frame)
+            rows = self.training_rows(frame, self.item_index)
+            features = features.store.extend(rows)
+        except (ValueError, TypeError, KeyError):
+            return False
+
+        # Saved rows are part of the dataset even if the retrain that appends them fails,
+        # so the index (shared with the serving predictor) takes them right away
+        for item, month, amount in zip(rows['Item_name'], rows['Month_name'], rows['Amount']):
+            if pd.notna(item):
+                self.item_index.update(item, month, float(amount))
+        self.save_item_index(fingerprint.hexdigest())
+        self.use_features(features, fingerprint)
+        return True
+
+    def use_features(self, features, fingerprint):
+        """Switch to a view of the preprocessed data and the fingerprint of the raw rows behind it"""
+        self._fingerprint = fingerprint
+        self.data_fingerprint = fingerprint.hexdigest()
+        # Picked here, in the serving process, where a sampling policy keeps its reservoir
+        self.training_index = self.training_policy.select(len(features)) if self.training_policy else None
+        self.features = features
+
+    def save_item_index(self, fingerprint):
+        """Write the item index after it changed, so the next preprocess_data can reuse it"""
+        try:
+            self.item_index.save(self.item_index_path, fingerprint)
+        except OSError as e:
+            print(f"Couldn't save the item index: {e}")
+
+    def latest_state(self, item):
+        """The item's last month and amount, row count, mean and rolling mean; None for an unseen item"""
+        return self.item_index.get(item) if self.item_index is not None else None
+
+    feature_columns = ['Month_Numeric', 'Item_Encoded', 'Previous_Amount']
+
+    @property
+    def df(self):
+        """Usable training rows with Month_Numeric and Item_Encoded, built from the feature arrays on first use"""
+        if self.features is None:
+            return None
+        return self.features.derived('df', lambda features: pd.DataFrame({
+            'Month_name': features.text_series('Month_name'),
+            'Item_name': features.text_series('Item_name'),
+            'Amount': features.values('Amount'),
+            'Month_Numeric': features.mapped('Month_name', MONTH_NUMERIC),
+            'Item_Encoded': features.sorted_codes('Item_name')[0]
+        }))
+
+    @property
+    def label_encoder(self):
+        """LabelEncoder fitted on the item names, without a pass over the rows"""
+        return self.features.derived('label_encoder', self._build_label_encoder)
+
+    @property
+    def training(self):
+        """Coded columns of the rows training_policy picks, their sample weights, and the held-out columns"""
+        return self.features.derived('training', lambda features: training_columns(
+            features, self.training_policy, self.training_index,
+            ['Month_name', 'Item_name'], ['Amount', 'Previous_Amount']))
+
+    @property
+    def X(self):
+        return self.features.derived('X', self._build_X)
+
+    @property
+    def y(self):
+        return self.features.derived('y', lambda features: pd.Series(self.training[0]['Amount'], name='Amount'))
+
+    @property
+    def sample_weight(self):
+        return self.training[1]
+
+    def _build_label_encoder(self, features):
+        label_encoder = LabelEncoder()
+        label_encoder.classes_ = np.array(features.sorted_codes('Item_name')[1], dtype=object)
+        return label_encoder
+
+    def _build_X(self, features):
+        columns = self.training[0]
+        return pd.DataFrame({
+            'Month_Numeric': features.mapped('Month_name', MONTH_NUMERIC, columns['Month_name']),
+            'Item_Encoded': features.sorted_codes('Item_name', columns['Item_name'])[0],
+            'Previous_Amount': columns['Previous_Amount']
+        })
+
+    def training_inputs(self):
+        """What a fit needs from the preprocessed data: X, y, sample weights, the held-out rows and the item encoder"""
+        # X and y leave out the held-out rows, kept in raw form for scoring this fit and its incremental updates
+        columns = self.training[2]
+        holdout = (
+            (
+                self.features.mapped('Month_name', MONTH_NUMERIC, columns['Month_name']),
+                self.features.decode('Item_name', columns['Item_name']).tolist(),
+                columns['Previous_Amount'].astype(float)
+            ),
+            columns['Amount'].astype(float)
+        )
+        return {'X': self.X, 'y': self.y, 'sample_weight': self.sample_weight, 'holdout': holdout,
+                'label_encoder': self.label_encoder}
+
+    def train_model(self, inputs=None):
+        """Advanced model training with cross-validation and imputation, on training_inputs() unless given ones"""
+        inputs = inputs or self.training_inputs()
+        X, y, label_encoder = inputs['X'], inputs['y'], inputs['label_encoder']
+
+        # Impute missing values; a lag column with no values yet (every item seen once) is kept, as zeros
+        imputer = SimpleImputer(strategy='median', keep_empty_features=True)
+        with span('impute_scale'):
+            X_imputed = imputer.fit_transform(X)
+        
+            # Scale features
+            scaler = StandardScaler()
+            X_scaled = scaler.fit_transform(X_imputed)
+        
+        self.training_size = len(y)
+        
+        # Train Random Forest with more robust parameters
+        model = RandomForestRegressor(
+            **(self.model_params or self.MODEL_PARAMS),
+            random_state=42,
+            n_jobs=self.n_jobs
+        )
+        with span('fit'):
+            model.fit(X_scaled, y, sample_weight=inputs['sample_weight'])
+
+        # Threads only pay off for the fit; single-row predicts stay sequential
+        model.set_params(n_jobs=None)
+
+        # Publish the fitted state, with plain NumPy copies of the preprocessing for the predict fast path
+        self.snapshot = RequirementModel(
+            columns=list(X.columns),
+            label_encoder=label_encoder,
+            imputer=imputer,
+            scaler=scaler,
+            model=model,
+            item_codes={item: code for code, item in enumerate(label_encoder.classes_)},
+            imputer_medians=imputer.statistics_.copy(),
+            scaler_mean=scaler.mean_.copy(),
+            scaler_scale=scaler.scale_.copy(),
+            holdout=inputs['holdout']
+        )
+
+    def predict(self, previous_month, previous_amount, current_month, item):
+        """Predict requirement with comprehensive input"""
+        try:
+            snapshot = self.snapshot
+
+            # Convert inputs to appropriate formats
+            previous_amount = float(str(previous_amount).replace(',', ''))
+            
+            # Fill a per-thread reusable row: Month_Numeric, Item_Encoded, Previous_Amount
+            with span('encode'):
+                input_row = getattr(self._buffers, 'row', None)
+                if input_row is None:
+                    input_row = self._buffers.row = np.empty((1, 3))
+                input_row[0, 0] = MONTH_NUMERIC[current_month]
+                input_row[0, 1] = snapshot.item_codes[item]
+                input_row[0, 2] = previous_amount
+
+                # Impute and scale input, same arithmetic as SimpleImputer and StandardScaler
+                np.copyto(input_row, snapshot.imputer_medians, where=np.isnan(input_row))
+                input_row -= snapshot.scaler_mean
+                input_row /= snapshot.scaler_scale
+                input_scaled = input_row
+            
+            # Predict and ensure non-negative result
+            with span('forest'):
+                predicted_amount = snapshot.model.predict(input_scaled)
+            return max(0, int(predicted_amount[0]))
+        
+        except Exception as e:
+            print(f"Prediction error: {e}")
+            return None
+
+    def predict_all(self, current_month):
+        """Predict every known item for a month from its own last observed amount, in one forest call"""
+        snapshot = self.snapshot
+
+        # Last amount per item from the item index, in dataset order; items the fitted
+        # encoding doesn't know are skipped
+        with span('latest_amounts'):
+            entries = self.item_index.entries
+            items = [item for item in list(entries) if item in snapshot.item_codes]
+            latest = [entries[item]['last_amount'] for item in items]
+
+        with span('encode'):
+            X = self.encode_rows(np.full(len(items), MONTH_NUMERIC[current_month], dtype=float),
+                                 items, np.array(latest, dtype=float))
+        with span('forest'):
+            predicted_amounts = np.maximum(0, snapshot.model.predict(X).astype(int))
+        return [
+            {'item': item, 'previous_amount': previous_amount, 'predicted_amount': predicted_amount}
+            for item, previous_amount, predicted_amount in zip(items, latest, predicted_amounts.tolist())
+        ]
+
+    def replace_model(self, model):
+        """Publish an incrementally updated forest with the current fitted encoding"""
+        self.snapshot = self.snapshot._replace(model=model)
+
+    def encode_rows(self, months, items, previous_amounts):
+        """Imputed, scaled feature rows; None if an item is not in the label encoding"""
+        snapshot = self.snapshot
+        codes = [snapshot.item_codes.get(item) for item in items]
+        if None in codes:
+            return None
+        X = np.column_stack([months, codes, previous_amounts]).astype(float)
+        np.copyto(X, snapshot.imputer_medians, where=np.isnan(X))
+        X -= snapshot.scaler_mean
+        X /= snapshot.scaler_scale
+        return X
+
+    def learning_rows(self, rows):
+        """Scaled features and targets for new dataset rows; None if they need a full refit"""
+        months, items, amounts = [], [], []
+        for row in rows:
+            # Same cleaning as preprocess_data: unparseable or non-positive amounts are dropped
+            amount = pd.to_numeric(str(row['Amount']).replace(',', ''), errors='coerce')
+            if not amount > 0:
+                continue
+            months.append(MONTH_NUMERIC.get(row['Month_name'], np.nan))
+            items.append(row['Item_name'])
+            amounts.append(float(amount))
+
+        # Called before append_data, so the index doesn't hold these rows yet and they go
+        # at the end of the store
+        X = self.encode_rows(months, items, self.previous_amounts(items, amounts, self.item_index))
+        if X is None:
+            return None
+        train = ~held_out(np.arange(len(amounts)) + self.features.store.rows)
+        return X.reshape(len(amounts), 3)[train], np.array(amounts)[train]
+
+    def recent_rows(self, window):
+        """Raw inputs and targets of the training rows among the last window rows"""
+        features = self.features
+        start = max(0, len(features) - window)
+        train = ~held_out(np.arange(start, len(features)))
+        inputs = (
+            np.array([MONTH_NUMERIC.get(month, np.nan) for month in features.text('Month_name', start)])[train],
+            features.text('Item_name', start)[train].tolist(),
+            features.values('Previous_Amount')[start:][train]
+        )
+        return inputs, features.values('Amount')[start:][train]
+
+    def new_row(self, previous_month, previous_amount, current_month, item):
+        """Build a dataset row from a prediction request"""
+        return {
+            'Month_name': current_month,
+            'Item_name': item,
+            'Amount': float(str(previous_amount).replace(',', ''))
+        }
+
+    def add_new_data(self, previous_month, previous_amount, current_month, item):
+        """Add new data point and retrain model"""
+        try:
+            # Prepare new data point
+            row = self.new_row(previous_month, previous_amount, current_month, item)
+            
+            # Save and retrain one writer at a time; predict keeps serving the
+            # previous snapshot until train_model swaps in the new one
+            with self.write_lock:
+                with span('save_dataset'):
+                    self.save_dataset([row])
+                with span('preprocess'):
+                    if not self.append_data([row]):
+                        self.preprocess_data()
+                with span('train'):
+                    self.train_model()
+            return True
+        except Exception as e:
+            print(f"Error adding new data: {e}")
+            return False
+
+    def save_dataset(self, rows):
+        """Append new rows to the dataset log"""
+        self.dataset.append(rows)
+
+
+def synthetic_patients(rows, rng):
+    """Random rows shaped like the patient dataset (20 departments), for the benchmarks"""
+    return pd.DataFrame({
+        'Month': np.array(MONTH_ORDER, dtype=object)[rng.integers(0, 12, rows)],
+        'Department': np.array([f'Department {index}' for index in range(20)], dtype=object)[
+            rng.integers(0, 20, rows)],
+        'Number': rng.integers(100, 3000, rows),
+    })
+
+
+def synthetic_requirements(rows, rng):
+    """Random rows shaped like the drug requirement dataset (30 items), for the benchmarks"""
+    return pd.DataFrame({
+        'Month_name': np.array(MONTH_ORDER, dtype=object)[rng.integers(0, 12, rows)],
+        'Item_name': np.array([f'Item {index}' for index in range(30)], dtype=object)[
+            rng.integers(0, 30, rows)],
+        'Amount': rng.integers(100, 20000, rows).astype(float),
+    })
+
+
+def stress_test(seconds=10.0, readers=8, writers=2):
+    """Hammer predict and add_new_data from many threads on scratch copies of the datasets"""
+    import time
+    import shutil
+    import random
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    patient = PatientPredictor(shutil.copy(PatientPredictor.DATASET_FILE, directory))
+    requirement = RequirementPredictor(shutil.copy(RequirementPredictor.DATASET_FILE, directory))
+    for predictor in (patient, requirement):
+        predictor.preprocess_data()
+        predictor.train_model()
+
+    deadline = time.monotonic() + seconds
+    counts = {'predicts': 0, 'retrains': 0}
+    failures = []
+    lock = threading.Lock()
+
+    def check(name, snapshot, ok):
+        if not ok:
+            failures.append(f"{name}: inconsistent snapshot {snapshot.columns}")
+
+    def read():
+        predicts = 0
+        while time.monotonic() < deadline:
+            try:
+                # Every field of one snapshot must describe the same fit
+                snapshot = patient.snapshot
+                check('patient', snapshot, len(snapshot.columns) == len(snapshot.departments) + 1
+                      == snapshot.scaler.n_features_in_ == snapshot.model.n_features_in_
+                      == snapshot.prediction_matrix.shape[1])
+                snapshot = requirement.snapshot
+                check('requirement', snapshot, len(snapshot.item_codes) == len(snapshot.label_encoder.classes_))
+
+                department = random.choice(patient.snapshot.departments + ['Stress Ward'])
+                patient.predict(random.choice(MONTH_ORDER), department)
+                item = random.choice(list(requirement.snapshot.item_codes))
+                if requirement.predict('January', 1000, random.choice(MONTH_ORDER), item) is None:
+                    failures.append(f"requirement: predict failed for {item}")
+                predicts += 2
+            except Exception as e:
+                failures.append(f"predict raised {e!r}")
+        with lock:
+            counts['predicts'] += predicts
+
+    def write(writer):
+        retrains = 0
+        while time.monotonic() < deadline:
+            # New departments and items change the column layout under the readers
+            patient.add_new_data('January', random.randint(10, 2000), random.choice(MONTH_ORDER),
+                                 f'Stress Ward {writer}-{retrains % 3}')
+            if not requirement.add_new_data('January', random.randint(100, 5000), random.choice(MONTH_ORDER),
+                                            f'Stress Drug {writer}-{retrains % 3}'):
+                failures.append('requirement: add_new_data failed')
+            retrains += 2
+        with lock:
+            counts['retrains'] += retrains
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads += [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{counts['predicts']} predicts and {counts['retrains']} retrains in {seconds:.0f}s "
+          f"across {readers} readers and {writers} writers: {len(failures)} failures")
+    for failure in failures[:10]:
+        print(f"  {failure}")
+    return not failures
+
+
+if __name__ == '__main__':
+    # Concurrency stress test: python forecasting.py [seconds]
+    import sys
+    sys.exit(0 if stress_test(float(sys.argv[1]) if len(sys.argv) > 1 else 10.0) else 1)
@@ -0,0 +1,138 @@
+import os
+import re
+import pickle
+import threading
+import collections
+from lazy_resource import LazyResource
+
+# Hospital IDs become directory names, so only allow plain identifiers
+HOSPITAL_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class UnknownHospital(KeyError):
+    def __str__(self):
+        return f"Unknown hospital: {self.args[0]}"
+
+
+def hospital_directory(root, hospital_id):
+    """Data directory of a hospital; UnknownHospital if the ID is malformed or has no data"""
+    if not isinstance(hospital_id, str) or not HOSPITAL_ID.match(hospital_id):
+        raise UnknownHospital(hospital_id)
+    directory = os.path.join(root, hospital_id)
+    if not os.path.isdir(directory):
+        raise UnknownHospital(hospital_id)
+    return directory
+
+
+def resident_bytes(retrainer):
+    """Rough resident size of a loaded predictor: its pickled snapshot plus its feature arrays"""
+    predictor = retrainer.current
+    size = len(pickle.dumps(predictor.snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+    if predictor.features is not None:
+        size += predictor.features.store.nbytes
+    return size
+
+
+class HospitalRegistry:
+    """Retrain workers per hospital, loaded on first use and evicted least recently used first
+
+    At most max_resident hospitals (and, if max_bytes is set, roughly that much
+    model memory) stay loaded. An evicted hospital's worker saves its queued rows,
+    closes its dataset log and stops before the request that evicted it returns;
+    the next request for it loads again, usually from its artifact, once that is
+    done. Rows submitted to the evicted worker afterwards go to the reloaded one.
+    """
+
+    def __init__(self, name, loader, max_resident=8, max_bytes=None):
+        self.name = name
+        # Called with a hospital ID, returns a loaded RetrainWorker
+        self.loader = loader
+        self.max_resident = max_resident
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # hospital ID -> LazyResource, least recently used first
+        self._entries = collections.OrderedDict()
+        self._sizes = {}
+        # hospital ID -> evicted worker that is still saving its rows
+        self._closing = {}
+        self.stats = collections.Counter()
+
+    def get(self, hospital_id):
+        """The hospital's retrain worker, loading it (and evicting others) if it isn't resident"""
+        with self._lock:
+            entry = self._entries.get(hospital_id)
+            if entry is not None and entry.ready:
+                self._entries.move_to_end(hospital_id)
+                self.stats['hits'] += 1
+                return entry.get()
+            self.stats['misses'] += 1
+            if entry is None:
+                entry = self._entries[hospital_id] = LazyResource(
+                    f'{self.name}[{hospital_id}]', lambda: self._load(hospital_id))
+
+        # Load outside the registry lock so other hospitals keep serving; the
+        # entry's own lock makes concurrent misses for one hospital load it once
+        try:
+            retrainer = entry.get()
+        except Exception:
+            with self._lock:
+                if self._entries.get(hospital_id) is entry:
+                    del self._entries[hospital_id]
+            raise
+
+        size = resident_bytes(retrainer) if self.max_bytes else 0
+        with self._lock:
+            if self._entries.get(hospital_id) is entry:
+                self._sizes[hospital_id] = size
+                self._entries.move_to_end(hospital_id)
+                evicted = self._evict(keep=hospital_id)
+            else:
+                evicted = []
+        for evicted_id, worker in evicted:
+            worker.successor = lambda evicted_id=evicted_id: self.get(evicted_id)
+            worker.close(close_dataset=True)
+            worker.join()
+            with self._lock:
+                if self._closing.get(evicted_id) is worker:
+                    del self._closing[evicted_id]
+        return retrainer
+
+    def _load(self, hospital_id):
+        """Load a hospital, after an evicted worker for it has closed its dataset log"""
+        # Two dataset logs open on one file would hand out the same LSNs
+        with self._lock:
+            closing = self._closing.get(hospital_id)
+        if closing is not None:
+            closing.join()
+        return self.loader(hospital_id)
+
+    def _evict(self, keep):
+        """Drop least recently used loaded entries until within budget; returns (ID, worker) pairs"""
+        evicted = []
+        for hospital_id in list(self._entries):
+            over_count = len(self._entries) > self.max_resident
+            over_bytes = self.max_bytes and sum(self._sizes.values()) > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            entry = self._entries[hospital_id]
+            # The hospital just loaded stays, and so do entries another request is still loading
+            if hospital_id == keep or not entry.ready:
+                continue
+            del self._entries[hospital_id]
+            self._sizes.pop(hospital_id, None)
+            self._closing[hospital_id] = entry.get()
+            evicted.append((hospital_id, entry.get()))
+            self.stats['evictions'] += 1
+        return evicted
+
+    def status(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                'resident': [hospital_id for hospital_id, entry in self._entries.items() if entry.ready],
+                'hits': self.stats['hits'],
+                'misses': self.stats['misses'],
+                'evictions': self.stats['evictions'],
+                'hit_rate': self.stats['hits'] / lookups if lookups else None,
+                'resident_bytes': sum(self._sizes.values()) if self.max_bytes else None,
+            }
@@ -0,0 +1,107 @@
+import copy
+import time
+import collections
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+
+class IncrementalForest:
+    """Keeps a predictor's fitted random forest current by swapping trees instead of refitting
+
+    Each update fits trees_per_update new trees on a sliding window of the most
+    recent rows and retires the same number of old trees, so the forest stays at
+    its trained size and an update costs the same however long the history grows.
+    Rows the fitted encoding can't represent (a new department or item) and every
+    refit_every-th update fall back to a full refit, which also measures how far
+    the incremental forest had drifted from a freshly trained one.
+
+    Predictors opt in by providing learning_rows(rows), recent_rows(window),
+    encode_rows(*inputs), replace_model(model) and a snapshot with the fitted
+    model and a holdout of (inputs, y). The holdout rows are the same in every fit
+    (training_set.held_out), and learning_rows and recent_rows leave them out, so
+    neither forest has trained on the rows the drift check scores.
+    """
+
+    def __init__(self, trees_per_update=10, window=500, refit_every=50, retire='oldest', history=50):
+        self.trees_per_update = trees_per_update
+        self.window = window
+        self.refit_every = refit_every
+        # 'oldest' drops trees in the order they were added, 'worst' drops the highest error on the window
+        self.retire = retire
+        self.drift = collections.deque(maxlen=history)
+
+    def update(self, predictor, rows):
+        """Grow predictor's forest with trees fit on the recent window; False if a full refit is needed"""
+        if getattr(predictor, 'updates_since_refit', 0) >= self.refit_every:
+            return False
+        learned = predictor.learning_rows(rows)
+        if learned is None:
+            return False
+        X_new, y_new = learned
+
+        # The window is replaced, never modified, so older snapshots keep theirs
+        window = getattr(predictor, 'recent_window', None)
+        if window is None:
+            inputs, y = predictor.recent_rows(self.window)
+            window = (predictor.encode_rows(*inputs), y)
+        X_window = np.vstack([window[0], X_new])[-self.window:]
+        y_window = np.concatenate([window[1], y_new])[-self.window:]
+        predictor.recent_window = (X_window, y_window)
+        predictor.updates_since_refit = getattr(predictor, 'updates_since_refit', 0) + 1
+        if len(y_new) == 0:
+            return True
+
+        # New trees use the same settings as the full forest, only fewer of them
+        model = predictor.snapshot.model
+        params = model.get_params()
+        params.update(n_estimators=self.trees_per_update, n_jobs=None, random_state=predictor.version)
+        recent = RandomForestRegressor(**params).fit(X_window, y_window)
+
+        predictor.replace_model(self.replace_trees(model, recent.estimators_, X_window, y_window))
+        return True
+
+    def replace_trees(self, model, new_trees, X_window, y_window):
+        """Copy of model with new_trees appended and as many old trees retired"""
+        old_trees = list(model.estimators_)
+        excess = max(0, len(old_trees) + len(new_trees) - model.n_estimators)
+        if self.retire == 'worst':
+            errors = [np.mean((tree.predict(X_window) - y_window) ** 2) for tree in old_trees]
+            keep = np.sort(np.argsort(errors, kind='stable')[:len(old_trees) - excess])
+            old_trees = [old_trees[index] for index in keep]
+        else:
+            old_trees = old_trees[excess:]
+
+        # Shallow copy so the serving snapshot's forest is left untouched
+        updated = copy.copy(model)
+        updated.estimators_ = old_trees + list(new_trees)
+        return updated
+
+    def refitted(self, previous, refitted):
+        """Record drift of the incrementally updated previous predictor against its full refit"""
+        updates = getattr(previous, 'updates_since_refit', 0)
+        refitted.updates_since_refit = 0
+        refitted.recent_window = None
+        if not updates:
+            return None
+
+        # Score both forests on the refit's held-out rows, which neither trained on, each through its own encoding
+        inputs, y = refitted.snapshot.holdout
+        X_previous = previous.encode_rows(*inputs)
+        if X_previous is None or len(y) == 0:
+            return None
+        incremental_mse = float(np.mean((previous.snapshot.model.predict(X_previous) - y) ** 2))
+        refit_mse = float(np.mean((refitted.snapshot.model.predict(refitted.encode_rows(*inputs)) - y) ** 2))
+
+        record = {
+            'time': time.time(),
+            'version': refitted.version,
+            'updates_since_refit': updates,
+            'incremental_mse': incremental_mse,
+            'refit_mse': refit_mse,
+            'drift': incremental_mse / refit_mse - 1 if refit_mse else None
+        }
+        self.drift.append(record)
+        drift = f"{record['drift']:+.1%}" if record['drift'] is not None else 'n/a'
+        print(f"{type(refitted).__name__} drift after {updates} incremental updates: "
+              f"MSE {incremental_mse:.1f} vs refit {refit_mse:.1f} ({drift})")
+        return record
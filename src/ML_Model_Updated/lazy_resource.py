@@ -0,0 +1,59 @@
+import time
+import threading
+
+
+class LazyResource:
+    """A model or predictor that is loaded on first use (or by warm_up) instead of at import"""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+        self.error = None
+        self.load_seconds = None
+
+    @property
+    def ready(self):
+        return self._value is not None
+
+    def get(self):
+        """Return the loaded value, loading it now if needed; a failed load is retried next call"""
+        value = self._value
+        if value is not None:
+            return value
+
+        with self._lock:
+            if self._value is None:
+                start = time.perf_counter()
+                try:
+                    self._value = self.loader()
+                    self.error = None
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.load_seconds = time.perf_counter() - start
+                print(f"Loaded {self.name} in {self.load_seconds:.2f}s")
+            return self._value
+
+    def set(self, value):
+        """Replace the loaded value, e.g. with a per-process wrapper after a fork"""
+        with self._lock:
+            self._value = value
+
+    def status(self):
+        return {'ready': self.ready, 'error': self.error, 'load_seconds': self.load_seconds}
+
+
+def warm_up(resources):
+    """Load every resource in its own background thread, so independent loads overlap"""
+    def load(resource):
+        try:
+            resource.get()
+        except Exception as e:
+            print(f"Warm-up of {resource.name} failed: {e}")
+
+    threads = [threading.Thread(target=load, args=(resource,), daemon=True) for resource in resources]
+    for thread in threads:
+        thread.start()
+    return threads
@@ -0,0 +1,223 @@
+import os
+import time
+import bisect
+import threading
+from flask import Response, request
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; RSS then comes from /proc only
+    resource = None
+
+# Latency buckets in seconds, from sub-millisecond table lookups to full retrains
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(**labels):
+    """Prometheus label set, e.g. {endpoint="/opd_priority",method="POST"}"""
+    pairs = ','.join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in labels.items()
+    )
+    return '{' + pairs + '}' if pairs else ''
+
+
+def family(name, kind, help_text, samples):
+    """Text exposition of one metric family from (labels dict, value) samples"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    lines += [f'{name}{_labels(**labels)} {value}' for labels, value in samples if value is not None]
+    return lines
+
+
+def mark_error():
+    """Count the current request as an error even though it is answered with status 200"""
+    request.environ['metrics.error'] = True
+
+
+class RequestMetrics:
+    """Per-endpoint request counts, error counts and latency histograms, recorded by Flask hooks"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (endpoint, method) -> [count per bucket..., +Inf count, sum of seconds]
+        self._latency = {}
+        # (endpoint, method, status) -> requests; errors include 200 responses marked by mark_error
+        self._requests = {}
+        self._errors = {}
+
+    def install(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        return self
+
+    # Each access through Flask's request proxy costs about as much as the bookkeeping
+    # itself, so the hooks resolve it once and keep the start time in the WSGI environ
+    def _start(self):
+        request.environ['metrics.start'] = time.perf_counter()
+
+    def _finish(self, response):
+        current = request._get_current_object()
+        start = current.environ.pop('metrics.start', None)
+        if start is not None:
+            status = response.status_code
+            # Priority handlers report failures as {'error': ...} with status 200 and mark them
+            error = status >= 400 or current.environ.pop('metrics.error', False)
+            rule = current.url_rule
+            self.observe(rule.rule if rule is not None else 'unmatched', current.method,
+                         status, time.perf_counter() - start, error)
+        return response
+
+    def observe(self, endpoint, method, status, seconds, error=False):
+        key = (endpoint, method)
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._latency.get(key)
+            if series is None:
+                series = self._latency[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += seconds
+            status_key = (endpoint, method, status)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            if error:
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def render(self):
+        with self._lock:
+            latency = {key: list(series) for key, series in self._latency.items()}
+            requests = dict(self._requests)
+            errors = dict(self._errors)
+
+        lines = family('ml_http_requests_total', 'counter', 'HTTP requests by endpoint, method and status', [
+            ({'endpoint': endpoint, 'method': method, 'status': status}, count)
+            for (endpoint, method, status), count in sorted(requests.items())
+        ])
+        lines += family('ml_http_request_errors_total', 'counter',
+                        'Requests answered with an error status or a marked error body', [
+                            ({'endpoint': endpoint, 'method': method}, count)
+                            for (endpoint, method), count in sorted(errors.items())
+                        ])
+
+        lines += ['# HELP ml_http_request_duration_seconds Request latency by endpoint',
+                  '# TYPE ml_http_request_duration_seconds histogram']
+        for (endpoint, method), series in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                labels = _labels(endpoint=endpoint, method=method, le=bound)
+                lines.append(f'ml_http_request_duration_seconds_bucket{labels} {cumulative}')
+            labels = _labels(endpoint=endpoint, method=method)
+            lines.append(f'ml_http_request_duration_seconds_sum{labels} {series[-1]}')
+            lines.append(f'ml_http_request_duration_seconds_count{labels} {cumulative}')
+        return lines
+
+
+def process_rss_bytes():
+    """Current resident set size, or the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return None
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def service_metrics(models, forecasting, registries=None):
+    """Model, retrain and dataset gauges, read at scrape time so requests pay nothing for them"""
+    lines = family('ml_model_ready', 'gauge', 'Whether the model has finished loading', [
+        ({'model': model.name}, int(model.ready)) for model in models
+    ])
+    lines += family('ml_model_load_seconds', 'gauge', 'Time the model took to load', [
+        ({'model': model.name}, model.load_seconds) for model in models
+    ])
+
+    # Only forecasting predictors that are already loaded; a scrape never triggers a load
+    loaded = [(name, lazy.get()) for name, lazy in forecasting.items() if lazy.ready]
+    lines += family('ml_model_version', 'gauge', 'Version of the predictor currently serving', [
+        ({'predictor': name}, retrainer.current.version) for name, retrainer in loaded
+    ])
+    lines += family('ml_dataset_rows', 'gauge', 'Rows in the dataset the serving predictor was prepared from', [
+        ({'predictor': name}, len(retrainer.current.features)) for name, retrainer in loaded
+        if retrainer.current.features is not None
+    ])
+    lines += family('ml_training_rows', 'gauge', 'Rows the serving model was fitted on, after the training policy', [
+        ({'predictor': name}, retrainer.current.training_size) for name, retrainer in loaded
+        if getattr(retrainer.current, 'training_size', None) is not None
+    ])
+    lines += family('ml_dataset_log_rows', 'gauge', 'Appended rows not yet compacted into the dataset CSV', [
+        ({'predictor': name}, len(retrainer.current.dataset)) for name, retrainer in loaded
+        if getattr(retrainer.current, 'dataset', None) is not None
+    ])
+
+    # Retrain telemetry lives where the retrain worker runs (the writer process under prefork.py)
+    workers = [(name, retrainer) for name, retrainer in loaded if hasattr(retrainer, 'stats')]
+    lines += family('ml_retrains_total', 'counter', 'Background retrains by outcome', [
+        ({'predictor': name, 'outcome': outcome}, retrainer.stats[outcome])
+        for name, retrainer in workers for outcome in ('retrained', 'updated incrementally', 'failed')
+    ])
+    lines += family('ml_retrain_seconds_total', 'counter', 'Time spent in background retrains', [
+        ({'predictor': name}, retrainer.stats['seconds']) for name, retrainer in workers
+    ])
+    lines += family('ml_retrain_last_seconds', 'gauge', 'Duration of the most recent retrain', [
+        ({'predictor': name}, retrainer.stats['last_seconds']) for name, retrainer in workers
+    ])
+    lines += family('ml_retrain_queue_depth', 'gauge', 'Rows waiting for the next retrain', [
+        ({'predictor': name}, retrainer.queue.qsize()) for name, retrainer in workers
+    ])
+
+    # Per-hospital predictor caches
+    registries = [(name, registry.status()) for name, registry in (registries or {}).items()]
+    for outcome in ('hits', 'misses', 'evictions'):
+        lines += family(f'ml_hospital_cache_{outcome}_total', 'counter', f'Per-hospital predictor cache {outcome}', [
+            ({'predictor': name}, status[outcome]) for name, status in registries
+        ])
+    lines += family('ml_hospital_cache_resident', 'gauge', 'Hospitals with a loaded predictor', [
+        ({'predictor': name}, len(status['resident'])) for name, status in registries
+    ])
+    lines += family('ml_hospital_cache_bytes', 'gauge', 'Estimated memory of the loaded hospital predictors', [
+        ({'predictor': name}, status['resident_bytes']) for name, status in registries
+    ])
+
+    lines += family('process_resident_memory_bytes', 'gauge', 'Resident memory of this process', [
+        ({}, process_rss_bytes())
+    ])
+    return lines
+
+
+def metrics_response(request_metrics, models, forecasting, registries=None):
+    lines = request_metrics.render() + service_metrics(models, forecasting, registries)
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+if __name__ == '__main__':
+    # Overhead of the per-request hooks: python metrics.py
+    from flask import Flask, jsonify
+
+    app = Flask(__name__)
+    request_metrics = RequestMetrics().install(app)
+
+    @app.route('/ping', methods=['POST'])
+    def ping():
+        return jsonify({'priority': 1})
+
+    iterations = 20000
+    start = time.perf_counter()
+    for index in range(iterations):
+        request_metrics.observe('/opd_priority', 'POST', 200, index * 1e-6)
+    observe = (time.perf_counter() - start) / iterations
+
+    # Both hooks inside a real request context, without the rest of the request
+    with app.test_request_context('/ping', method='POST'):
+        response = jsonify({'priority': 1})
+        start = time.perf_counter()
+        for _ in range(iterations):
+            request_metrics._start()
+            request_metrics._finish(response)
+        hooks = (time.perf_counter() - start) / iterations
+
+    print(f"observe: {observe * 1e6:.2f} us per request")
+    print(f"before_request + after_request hooks: {hooks * 1e6:.2f} us per request")
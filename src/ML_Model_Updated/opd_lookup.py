@@ -0,0 +1,79 @@
+import os
+import math
+import time
+import threading
+import numpy as np
+
+
+class OPDLookupTable:
+    """Final OPD priority precomputed for every on-grid input, rebuilt when the model file changes"""
+
+    def __init__(self, model_path, load_model, adjust_priorities,
+                 max_severity=10, max_age=120, poll_interval=5.0):
+        self.model_path = model_path
+        self.load_model = load_model
+        self.adjust_priorities = adjust_priorities
+        # Grid axes: illness_severity, age, transmittable, disabled, patient_rating
+        self.shape = (max_severity + 1, max_age + 1, 2, 2, 5)
+        self.poll_interval = poll_interval
+        self._state = None
+        self.build()
+
+    def build(self):
+        """Load the model and evaluate it over the whole grid in one predict call"""
+        start = time.perf_counter()
+        mtime = os.path.getmtime(self.model_path)
+        model = self.load_model(self.model_path)
+
+        # One row per (illness_severity, age, transmittable, disabled) combination
+        grid = np.indices(self.shape[:4], dtype=np.float32).reshape(4, -1).T
+        predictions = model.predict(grid)
+
+        # Apply every patient_rating to every prediction
+        ratings = np.arange(1, 6, dtype=np.float32)
+        priorities = self.adjust_priorities(predictions[:, None], ratings[None, :])
+        table = priorities.astype(np.int16).reshape(self.shape)
+
+        # Swap model and table together so readers never see a mismatched pair
+        self._state = (model, table, mtime)
+        print(f"OPD lookup table built: {table.size} cells, {table.nbytes / 1024:.1f} KiB, "
+              f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+    @property
+    def model(self):
+        return self._state[0]
+
+    def predict(self, X):
+        """Raw predictions from the model the table was built from"""
+        return self._state[0].predict(X)
+
+    def lookup(self, features, patient_rating):
+        """Final priority for an on-grid input, or None if it has to go to the live model"""
+        table = self._state[1]
+        index = []
+        for value, size in zip(features, table.shape):
+            # NaN and inf (e.g. a null age) are never on the grid
+            if not math.isfinite(value):
+                return None
+            position = int(value)
+            if position != value or not 0 <= position < size:
+                return None
+            index.append(position)
+        if not 1 <= patient_rating <= 5:
+            return None
+        index.append(patient_rating - 1)
+        return int(table[tuple(index)])
+
+    def watch(self):
+        """Rebuild in the background whenever the model file's mtime changes"""
+        def poll():
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    if os.path.getmtime(self.model_path) != self._state[2]:
+                        self.build()
+                except Exception as e:
+                    print(f"OPD lookup table rebuild failed: {e}")
+
+        threading.Thread(target=poll, daemon=True).start()
+        return self
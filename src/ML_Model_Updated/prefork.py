@@ -0,0 +1,479 @@
+# Pre-fork serving for app.py: load every model once, then fork the serving workers.
+#
+# The parent loads the priority models and both forecasting predictors, freezes the
+# garbage collector and forks, so workers share those pages copy-on-write instead of
+# each unpickling its own copy. One extra child, the writer, owns the dataset logs and
+# retrain workers, the per-hospital ones included; serving workers queue new rows to it
+# over a pipe and pick up each snapshot it publishes to model_artifacts/serving. A
+# hospital a serving worker hasn't seen yet is loaded by the writer too, on request.
+#
+#     python prefork.py serve --workers 4 --port 5000
+#     python prefork.py bench --workers 1,2,4
+#
+# Needs os.fork (Linux/macOS); the single-process `python app.py` still works everywhere.
+import os
+import gc
+import sys
+import json
+import time
+import pickle
+import signal
+import socket
+import argparse
+import threading
+from training_orchestrator import _detached
+
+# Models are loaded explicitly before the fork, not by app.py's warm-up threads
+os.environ['LAZY_WARM_UP'] = '0'
+
+PUBLISH_DIRECTORY = os.path.join('model_artifacts', 'serving')
+
+# How long a serving worker waits for the writer to load a hospital
+HOSPITAL_LOAD_TIMEOUT = 300.0
+
+
+def published_path(name, hospital_id=None):
+    """Where the writer publishes a predictor's snapshots; hospital IDs are safe file names"""
+    return os.path.join(PUBLISH_DIRECTORY, f'{name}.pkl' if hospital_id is None else f'{name}.{hospital_id}.pkl')
+
+
+def _write_state(path, state):
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def publisher(path):
+    """on_swap callback for a RetrainWorker that writes its current predictor to path
+
+    The predictor goes without its dataset log and writer lock, which stay with the writer.
+    """
+    def publish(worker):
+        _write_state(path, {'predictor': _detached(worker.current), 'drift': worker.drift})
+    return publish
+
+
+class SnapshotFollower:
+    """Stands in for a RetrainWorker in a serving worker: rows go to the writer, snapshots come back"""
+
+    def __init__(self, name, predictor, rows_fd, hospital_id=None, poll_interval=1.0):
+        self.name = name
+        self.hospital_id = hospital_id
+        # None until the writer has published the predictor
+        self.current = predictor
+        self.drift = []
+        self.path = published_path(name, hospital_id)
+        self.rows_fd = rows_fd
+        self.poll_interval = poll_interval
+        self._mtime = None
+        self._closed = threading.Event()
+
+    def submit(self, row):
+        self._send('row', row)
+
+    def request_refit(self):
+        self._send('refit')
+
+    def _send(self, action, row=None):
+        # Writes under PIPE_BUF bytes are atomic, so lines from different workers never interleave
+        message = json.dumps([action, self.name, self.hospital_id, row]).encode() + b'\n'
+        try:
+            os.write(self.rows_fd, message)
+        except BlockingIOError:
+            print(f"Writer is not keeping up, dropped a {self.name} {action}")
+
+    def _published_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        """Swap in the writer's latest snapshot if it has published a new one; raises a failed load it reported"""
+        mtime = self._published_mtime()
+        if mtime is None or mtime == self._mtime:
+            return
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        self._mtime = mtime
+        if 'error' in state:
+            raise RuntimeError(state['error'])
+
+        # Single-assignment swap, as in RetrainWorker
+        self.drift = state['drift']
+        self.current = state['predictor']
+
+    def load(self, timeout=HOSPITAL_LOAD_TIMEOUT):
+        """Ask the writer to load this predictor and wait until it is published"""
+        # Another serving worker may have had it loaded already; an error left by an
+        # earlier failed load is skipped, it isn't this load's answer
+        try:
+            self.reload()
+        except RuntimeError:
+            pass
+        if self.current is not None:
+            return self
+
+        self._send('load')
+        deadline = time.monotonic() + timeout
+        while True:
+            self.reload()
+            if self.current is not None:
+                return self
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"The writer didn't load {self.path} within {timeout:.0f}s")
+            time.sleep(0.1)
+
+    def watch(self):
+        """Poll for published snapshots in the background"""
+        def poll():
+            while not self._closed.wait(self.poll_interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Reloading published {self.name} snapshot failed: {e}")
+
+        threading.Thread(target=poll, daemon=True).start()
+        return self
+
+    def close(self, close_dataset=False):
+        """Stop polling; the writer keeps the predictor and its dataset"""
+        self._closed.set()
+
+    def join(self, timeout=None):
+        """Nothing to wait for: rows already went to the writer"""
+        return True
+
+
+def follower_loader(name, rows_fd):
+    """HospitalRegistry loader for a serving worker: the writer loads the hospital, this follows it"""
+    def load(hospital_id):
+        import app
+        from hospital_registry import hospital_directory
+
+        # Unknown hospitals are turned away here, without a round trip to the writer
+        hospital_directory(app.HOSPITAL_DATA_DIRECTORY, hospital_id)
+        return SnapshotFollower(name, None, rows_fd, hospital_id).load().watch()
+    return load
+
+
+def publishing_loader(name, load):
+    """HospitalRegistry loader for the writer: load the hospital's retrain worker and publish each swap"""
+    def load_and_publish(hospital_id):
+        path = published_path(name, hospital_id)
+        try:
+            worker = load(hospital_id)
+        except Exception as e:
+            # A serving worker waiting on this load gets the error instead of timing out
+            _write_state(path, {'error': f"Loading {name} for hospital {hospital_id} failed: {e}"})
+            raise
+        worker.on_swap = publisher(path)
+        worker.on_swap(worker)
+        return worker
+    return load_and_publish
+
+
+def unavailable(name, error):
+    """Loader for a forecasting predictor that failed to load before the fork"""
+    def load():
+        raise RuntimeError(f"{name} failed to load at startup: {error}")
+    return load
+
+
+def run_writer(rows_fd):
+    """Writer process: apply queued rows through the retrain workers and publish every swap"""
+    import app
+    from column_store import open_dataset
+    from artifact_store import ArtifactStore
+    from retrain_worker import RetrainWorker
+
+    # The parent's training pool and forkserver can't be used from a forked child; the
+    # writer is already a process of its own, so it fits in-process, hospitals included
+    store = ArtifactStore()
+    app.artifact_store.set(store)
+    hospitals = app.HOSPITAL_REGISTRIES
+    for name, registry in hospitals.items():
+        registry.loader = publishing_loader(name, registry.loader)
+
+    workers = {}
+    for name, resource in app.FORECASTING_RESOURCES.items():
+        # Rows for a predictor that failed to load in the parent are dropped with a message
+        if not resource.ready:
+            continue
+        loaded = resource.get()
+        predictor = loaded.current
+
+        # The parent closed its dataset log before forking; this one is now its only writer and compactor
+        predictor.dataset = open_dataset(predictor.csv_path)
+        workers[name] = RetrainWorker(
+            predictor, store, incremental=loaded.incremental,
+            on_swap=publisher(published_path(name))
+        )
+        workers[name].on_swap(workers[name])
+
+    with os.fdopen(rows_fd, 'rb') as rows:
+        for line in rows:
+            try:
+                action, name, hospital_id, row = json.loads(line)
+                # A hospital is loaded (and published) by its first message of any kind; loading
+                # one that has no artifact yet holds up the messages behind it for one fit
+                worker = workers[name] if hospital_id is None else hospitals[name].get(hospital_id)
+                if action == 'row':
+                    worker.submit(row)
+                elif action == 'refit':
+                    worker.request_refit()
+            except Exception as e:
+                print(f"Writer ignored a {line[:80]!r} message: {e}")
+
+
+def run_server(listener, host, port, rows_fd, threaded=True):
+    """Serving worker: answer requests from the inherited models and follow published snapshots"""
+    import app
+    from werkzeug.serving import make_server
+    from opd_lookup import OPDLookupTable
+
+    for name, resource in app.FORECASTING_RESOURCES.items():
+        if resource.ready:
+            resource.set(SnapshotFollower(name, resource.get().current, rows_fd).watch())
+        else:
+            # Retrying here would open the dataset log the writer owns
+            resource.loader = unavailable(name, resource.error)
+    # Hospitals are loaded and retrained by the writer; this process only follows them
+    for name, registry in app.HOSPITAL_REGISTRIES.items():
+        registry.loader = follower_loader(name, rows_fd)
+
+    # The lookup table's model watcher thread stayed behind in the parent
+    if app.stage_one.ready and isinstance(app.stage_one.get(), OPDLookupTable):
+        app.stage_one.get().watch()
+
+    server = make_server(host, port, app.app, threaded=threaded, fd=listener.fileno())
+    server.serve_forever()
+
+
+def memory_usage(pid):
+    """RSS, PSS and private memory of a process in MB from /proc (None where unavailable)"""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.endswith('kB\n')}
+    except OSError:
+        return None
+    return {
+        'rss_mb': fields['Rss'] / 1024,
+        'pss_mb': fields['Pss'] / 1024,
+        'private_mb': (fields['Private_Clean'] + fields['Private_Dirty']) / 1024
+    }
+
+
+def memory_report(children):
+    for pid, role in sorted(children.items()):
+        usage = memory_usage(pid)
+        if usage is None:
+            print(f"  {role} {pid}: memory usage unavailable")
+        else:
+            print(f"  {role} {pid}: RSS {usage['rss_mb']:.0f} MB, PSS {usage['pss_mb']:.0f} MB, "
+                  f"private {usage['private_mb']:.0f} MB")
+
+
+def serve(host='127.0.0.1', port=5000, workers=2, threaded=True):
+    """Load the models, fork one writer and `workers` serving processes, and keep them running"""
+    import app
+
+    # Best-effort, as in app.py's warm-up: a model that fails to load is reported by /readyz
+    # and answered with an error by its endpoints, the rest are still served
+    start = time.perf_counter()
+    for resource in app.LAZY_RESOURCES:
+        try:
+            resource.get()
+        except Exception as e:
+            print(f"Loading {resource.name} failed: {e}")
+    loaded = sum(resource.ready for resource in app.LAZY_RESOURCES)
+    print(f"Loaded {loaded} of {len(app.LAZY_RESOURCES)} models in {time.perf_counter() - start:.2f}s")
+
+    # The writer takes the datasets over. A retrain worker or compactor left running here
+    # would fold the same logged rows into the dataset a second time
+    for resource in app.FORECASTING_RESOURCES.values():
+        if not resource.ready:
+            continue
+        retrainer = resource.get()
+        retrainer.close(close_dataset=True)
+        retrainer.join()
+
+    # Snapshots from a previous run must not be mistaken for the writer's
+    os.makedirs(PUBLISH_DIRECTORY, exist_ok=True)
+    for name in os.listdir(PUBLISH_DIRECTORY):
+        os.remove(os.path.join(PUBLISH_DIRECTORY, name))
+
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+
+    # Serving workers never wait on the writer; a full pipe drops rows instead
+    rows_read, rows_write = os.pipe()
+    os.set_blocking(rows_write, False)
+
+    # Objects loaded so far are never collected, so child GC passes don't touch their pages
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+
+    def spawn(role):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                if role == 'writer':
+                    listener.close()
+                    os.close(rows_write)
+                    run_writer(rows_read)
+                else:
+                    os.close(rows_read)
+                    run_server(listener, host, port, rows_write, threaded)
+            except KeyboardInterrupt:
+                pass
+            except BaseException as e:
+                print(f"{role} {os.getpid()} exited: {e!r}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = role
+
+        # Lets `prefork.py bench` tell the serving workers from the writer
+        with open(os.path.join(PUBLISH_DIRECTORY, 'children.json'), 'w') as f:
+            json.dump(children, f)
+
+    spawn('writer')
+    for _ in range(workers):
+        spawn('worker')
+    print(f"Serving on http://{host}:{port} with {workers} workers and 1 writer")
+
+    def shutdown(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        time.sleep(2)
+        memory_report(children)
+
+        # Replace children that die, after a short pause so a crash loop doesn't spin
+        while True:
+            pid, status = os.wait()
+            role = children.pop(pid, None)
+            if role is None:
+                continue
+            print(f"{role} {pid} exited with status {status}, restarting")
+            time.sleep(1)
+            spawn(role)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def _drive(port, requests, result):
+    """Load-generator process: send requests over one keep-alive connection"""
+    import http.client
+    bodies = [
+        ('/opd_priority', {'illness_severity': 3, 'age': 40, 'transmittable': 1, 'disabled': 0, 'patient_rating': 4}),
+        ('/bed_priority', {'illness_severity': 4, 'doctor_offset': 2, 'age': 70, 'waiting_period': 3,
+                           'transmittable': 0, 'disabled': 1}),
+        ('/patient_prediction', {'current_month': 'March', 'department': 'ENT'}),
+    ]
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    start = time.perf_counter()
+    for index in range(requests):
+        path, body = bodies[index % len(bodies)]
+        connection.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+        connection.getresponse().read()
+    result.put(time.perf_counter() - start)
+
+
+def bench(worker_counts=(1, 2, 4), port=5099, requests=3000, concurrency=8):
+    """Throughput and per-worker memory of `prefork.py serve` for each worker count"""
+    import subprocess
+    import multiprocessing
+    import urllib.error
+    import urllib.request
+
+    rows = []
+    for workers in worker_counts:
+        server = subprocess.Popen(
+            [sys.executable, __file__, 'serve', '--workers', str(workers), '--port', str(port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            # Wait until a worker answers /readyz. A 503 is an answer too: models that
+            # failed to load are listed, and the benchmark runs with the rest
+            deadline = time.monotonic() + 300
+            while True:
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/readyz', timeout=1)
+                    break
+                except urllib.error.HTTPError as e:
+                    failed = [name for name, status in json.load(e)['models'].items() if not status['ready']]
+                    print(f"Benchmarking {workers} workers without {', '.join(failed)}")
+                    break
+                except Exception:
+                    if time.monotonic() > deadline or server.poll() is not None:
+                        raise RuntimeError(f"server with {workers} workers did not start")
+                    time.sleep(0.5)
+
+            result = multiprocessing.Queue()
+            clients = [
+                multiprocessing.Process(target=_drive, args=(port, requests // concurrency, result))
+                for _ in range(concurrency)
+            ]
+            for client in clients:
+                client.start()
+            elapsed = max(result.get() for _ in clients)
+            for client in clients:
+                client.join()
+
+            with open(os.path.join(PUBLISH_DIRECTORY, 'children.json')) as f:
+                children = [int(pid) for pid, role in json.load(f).items() if role == 'worker']
+            usages = [usage for usage in map(memory_usage, children) if usage is not None]
+            rows.append({
+                'workers': workers,
+                'requests_per_second': (requests // concurrency) * concurrency / elapsed,
+                'worker_pss_mb': sum(usage['pss_mb'] for usage in usages) / len(usages) if usages else None,
+                'worker_private_mb': sum(usage['private_mb'] for usage in usages) / len(usages) if usages else None,
+                'worker_rss_mb': sum(usage['rss_mb'] for usage in usages) / len(usages) if usages else None,
+            })
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'workers':>7} {'req/s':>8} {'speedup':>7} {'RSS MB':>7} {'PSS MB':>7} {'private MB':>10}  (per worker)")
+    for row in rows:
+        memory = [row[key] for key in ('worker_rss_mb', 'worker_pss_mb', 'worker_private_mb')]
+        memory = [f'{value:.0f}' if value is not None else '-' for value in memory]
+        print(f"{row['workers']:>7} {row['requests_per_second']:>8.0f} "
+              f"{row['requests_per_second'] / rows[0]['requests_per_second']:>6.2f}x "
+              f"{memory[0]:>7} {memory[1]:>7} {memory[2]:>10}")
+    print(f"({os.cpu_count()} CPUs available)")
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-fork serving for app.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='run the pre-fork server')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=5000)
+    serve_parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    serve_parser.add_argument('--single-threaded', action='store_true', help='one request at a time per worker')
+    bench_parser = commands.add_parser('bench', help='measure throughput and memory for several worker counts')
+    bench_parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    bench_parser.add_argument('--requests', type=int, default=3000)
+    bench_parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.host, args.port, args.workers, threaded=not args.single_threaded)
+    else:
+        bench([int(count) for count in args.workers.split(',')], requests=args.requests,
+              concurrency=args.concurrency)
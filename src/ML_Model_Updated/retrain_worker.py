@@ -0,0 +1,176 @@
+import copy
+import queue
+import time
+import threading
+import collections
+from timing import span, start_trace, end_trace
+
+
+class RetrainWorker:
+    """Retrains a predictor in the background from queued rows, one retrain per burst"""
+
+    def __init__(self, predictor, artifact_store=None, debounce_seconds=2.0, max_wait_seconds=30.0,
+                 incremental=None, on_swap=None):
+        # Requests read self.current once and keep using that snapshot
+        self.current = predictor
+        self.artifact_store = artifact_store
+        # Writers share the predictor's lock with add_new_data; predictors without one get their own
+        self.write_lock = getattr(predictor, 'write_lock', None) or threading.Lock()
+        # Optional IncrementalForest; without one every burst is a full refit
+        self.incremental = incremental
+        self._refit_requested = False
+        self._closed = False
+        self._close_dataset = False
+        # Orders submit against close, so no row is queued behind the closing sentinel
+        self._submit_lock = threading.Lock()
+        self._stopped = threading.Event()
+        # Called by submit after close for the worker that now owns the dataset, if any
+        self.successor = None
+        # Called with this worker after every swap, e.g. to publish the snapshot to other processes
+        self.on_swap = on_swap
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.queue = queue.Queue()
+        # Counts by outcome ('retrained', 'updated incrementally', 'failed') and seconds spent
+        self.stats = collections.Counter()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, row):
+        """Queue a new dataset row for the next retrain"""
+        with self._submit_lock:
+            if not self._closed:
+                self.queue.put(row)
+                return
+
+        # Nothing will retrain here any more, but the row still belongs in the dataset
+        if self.successor is not None:
+            self.successor().submit(row)
+            return
+        with self.write_lock:
+            self.current.save_dataset([row])
+
+    @property
+    def drift(self):
+        """Drift records of the incremental mode, oldest first"""
+        return list(self.incremental.drift) if self.incremental is not None else []
+
+    def request_refit(self):
+        """Make the next retrain a full refit, waking the worker if it is idle"""
+        self._refit_requested = True
+        self.queue.put(None)
+
+    def _collect_burst(self):
+        """Block for one row, then keep taking rows until the queue has been quiet for debounce_seconds"""
+        rows = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            # A closing worker only saves what is already queued, it doesn't wait for more
+            if self._closed:
+                while not self.queue.empty():
+                    rows.append(self.queue.get_nowait())
+                return rows
+            timeout = min(self.debounce_seconds, deadline - time.monotonic())
+            if timeout <= 0:
+                return rows
+            try:
+                rows.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                return rows
+
+    def close(self, close_dataset=False):
+        """Stop the worker once the rows queued so far are saved, without retraining on them
+
+        With close_dataset the predictor's dataset log is closed after those rows, so
+        rows submitted later go to the successor (or fail without one). join() waits
+        until this is done.
+        """
+        with self._submit_lock:
+            self._close_dataset = close_dataset
+            self._closed = True
+            self.queue.put(None)
+
+    def join(self, timeout=None):
+        """Wait until a closed worker has saved its queued rows; False on timeout"""
+        return self._stopped.wait(timeout)
+
+    @staticmethod
+    def _append(predictor, rows):
+        """Extend predictor's preprocessed data with saved rows; False if it has to preprocess everything"""
+        append_data = getattr(predictor, 'append_data', None)
+        return append_data is not None and append_data(rows)
+
+    def _run(self):
+        while True:
+            rows = [row for row in self._collect_burst() if row is not None]
+            if self._closed:
+                try:
+                    with self.write_lock:
+                        if rows:
+                            self.current.save_dataset(rows)
+                        if self._close_dataset:
+                            self.current.dataset.close()
+                finally:
+                    self._stopped.set()
+                return
+            try:
+                self.retrain(rows)
+            except Exception as e:
+                self.stats['failed'] += 1
+                print(f"Background retrain failed: {e}")
+
+    def retrain(self, rows):
+        """Fit a copy of the current predictor on the new rows, then swap it in"""
+        # A refit request that a previous burst already served leaves nothing to do
+        refit = self._refit_requested or self.incremental is None
+        if not rows and not refit:
+            return
+
+        # Readers never take the write lock
+        current = self.current
+        with self.write_lock:
+            start = time.perf_counter()
+            # Same stage spans as a request, reported in the summary line below
+            trace = start_trace()
+
+            # Work on a shallow copy; preprocess_data, append_data and train_model only reassign attributes
+            candidate = copy.copy(current)
+            candidate.version = current.version + 1
+            if rows:
+                with span('save_dataset'):
+                    candidate.save_dataset(rows)
+
+            # Grow the existing forest when possible, otherwise refit on the whole dataset.
+            # Either way the new rows are appended to the preprocessed data, which only
+            # falls back to preprocessing everything when they don't fit its columns
+            if not refit and self.incremental.update(candidate, rows):
+                with span('preprocess'):
+                    if not self._append(candidate, rows):
+                        candidate.preprocess_data()
+                mode = 'updated incrementally'
+            else:
+                # A requested refit also rereads the dataset from disk
+                reload = self._refit_requested or not rows
+                self._refit_requested = False
+                with span('preprocess'):
+                    if reload or not self._append(candidate, rows):
+                        candidate.preprocess_data()
+                with span('train'):
+                    if self.artifact_store is not None:
+                        self.artifact_store.load_or_train(candidate)
+                    else:
+                        candidate.train_model()
+                if self.incremental is not None:
+                    self.incremental.refitted(current, candidate)
+                mode = 'retrained'
+
+            # Single reference assignment, so readers see either the old or the new model
+            self.current = candidate
+            end_trace()
+        elapsed = time.perf_counter() - start
+        self.stats[mode] += 1
+        self.stats['seconds'] += elapsed
+        self.stats['last_seconds'] = elapsed
+        print(f"{type(candidate).__name__} {mode} on {len(rows)} new rows "
+              f"in {elapsed:.2f}s, now version {candidate.version} ({trace.summary()})")
+        if self.on_swap is not None:
+            self.on_swap(self)
@@ -0,0 +1,247 @@
+import os
+import io
+import csv
+import json
+import time
+import hashlib
+import threading
+import pandas as pd
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _fsync_dir(path):
+    """Make a rename in this directory durable (no-op where directories can't be opened)"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path, data):
+    """Write bytes to a temp file, fsync it and rename it over path"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+
+
+class RowLog:
+    """CSV dataset with an append-only JSON-lines log of new rows in front of it
+
+    Appends cost one small write no matter how big the dataset is; writers that
+    arrive together share a single fsync (group commit). A background compactor
+    folds the log into the CSV through an atomic-rename snapshot.
+
+    Every log entry carries a log sequence number (LSN). The sidecar .meta file
+    records which LSNs the CSV already contains together with the CSV's hash, so
+    recovery can tell whether a crash happened before or after the snapshot rename
+    and never replays a row twice.
+    """
+
+    def __init__(self, base_path, compact_interval=60.0, compact_min_rows=200):
+        self.base_path = base_path
+        self.log_path = base_path + '.log'
+        self.meta_path = base_path + '.meta'
+        self.compact_min_rows = compact_min_rows
+
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._compact_lock = threading.Lock()
+        self._pending = []
+        self._flushing = False
+        self._flushed_lsn = 0
+        self._failures = []
+        self._closed = threading.Event()
+
+        self.recover()
+        self._log_file = open(self.log_path, 'ab')
+        self._log_size = self._log_file.tell()
+
+        if compact_interval:
+            threading.Thread(target=self._compact_loop, args=(compact_interval,), daemon=True).start()
+
+    def recover(self):
+        """Work out which LSNs the CSV holds and drop any torn write at the log tail"""
+        self.folded_lsn = 0
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            # A crash between writing .meta and renaming the snapshot leaves the old CSV
+            if self.snapshot_hash() == meta['base_hash']:
+                self.folded_lsn = meta['folded_lsn']
+            else:
+                self.folded_lsn = meta['previous_folded_lsn']
+
+        self._entries = []
+        valid_bytes = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    if not line.endswith(b'\n'):
+                        break
+                    valid_bytes += len(line)
+                    if entry['lsn'] > self.folded_lsn:
+                        self._entries.append(entry)
+            os.truncate(self.log_path, valid_bytes)
+
+        last_lsn = self._entries[-1]['lsn'] if self._entries else self.folded_lsn
+        self._next_lsn = last_lsn + 1
+        self._flushed_lsn = last_lsn
+
+    def snapshot_hash(self):
+        """Hash of the file whose rename commits a compaction"""
+        return _file_hash(self.base_path)
+
+    def read_base(self):
+        return pd.read_csv(self.base_path)
+
+    def load(self):
+        """Base CSV plus every logged row not yet folded into it"""
+        # A compaction between reading the entries and the base would count its rows twice
+        with self._compact_lock:
+            with self._lock:
+                entries = list(self._entries)
+            return self._with_entries(self.read_base(), entries)
+
+    def _with_entries(self, df, entries):
+        if entries:
+            df = pd.concat([df, pd.DataFrame([entry['row'] for entry in entries])], ignore_index=True)
+        return df
+
+    def append(self, rows):
+        """Durably append rows; returns once they are fsynced, sharing the fsync with concurrent writers"""
+        with self._lock:
+            if self._closed.is_set():
+                raise IOError(f"Row log {self.log_path} is closed")
+            for row in rows:
+                entry = {'lsn': self._next_lsn, 'row': row}
+                self._next_lsn += 1
+                self._pending.append(entry)
+            my_lsn = self._next_lsn - 1
+
+            while self._flushed_lsn < my_lsn:
+                if self._flushing:
+                    # Another writer is the leader; its fsync may cover our rows too
+                    self._committed.wait()
+                    continue
+
+                # Become the leader and flush everything queued so far
+                batch = self._pending
+                self._pending = []
+                self._flushing = True
+                self._lock.release()
+                failure = None
+                try:
+                    data = b''.join(json.dumps(entry).encode() + b'\n' for entry in batch)
+                    self._log_file.write(data)
+                    self._log_file.flush()
+                    os.fsync(self._log_file.fileno())
+                except Exception as e:
+                    failure = e
+                    # Cut off any partial write so later appends stay readable
+                    self._log_file.truncate(self._log_size)
+                finally:
+                    self._lock.acquire()
+                    self._flushing = False
+                    if failure is None:
+                        self._entries.extend(batch)
+                        self._log_size += len(data)
+                    else:
+                        self._failures = self._failures[-15:] + [(batch[0]['lsn'], batch[-1]['lsn'], failure)]
+                    self._flushed_lsn = batch[-1]['lsn']
+                    self._committed.notify_all()
+
+            for first_lsn, last_lsn, failure in self._failures:
+                if first_lsn <= my_lsn <= last_lsn:
+                    raise IOError(f"Row log write failed: {failure}")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        """Stop compacting and close the log file, e.g. before another process takes the dataset over"""
+        self._closed.set()
+        # Let a compaction in progress finish; later ones see the flag and do nothing
+        with self._compact_lock:
+            with self._lock:
+                while self._flushing:
+                    self._committed.wait()
+                self._log_file.close()
+
+    def compact(self):
+        """Fold logged rows into the base CSV via an atomic-rename snapshot, then trim the log"""
+        with self._compact_lock:
+            with self._lock:
+                entries = list(self._entries)
+            if not entries or self._closed.is_set():
+                return 0
+
+            snapshot = self.build_snapshot(entries)
+
+            # .meta is written first; its hash tells recovery whether the rename below happened
+            folded_lsn = entries[-1]['lsn']
+            meta = {
+                'folded_lsn': folded_lsn,
+                'previous_folded_lsn': self.folded_lsn,
+                'base_hash': hashlib.sha256(snapshot).hexdigest()
+            }
+            _write_atomic(self.meta_path, json.dumps(meta).encode())
+            self.commit_snapshot(snapshot)
+
+            # Rewrite the log without the folded entries; appends wait for this short step
+            with self._lock:
+                while self._flushing:
+                    self._committed.wait()
+                self.folded_lsn = folded_lsn
+                self._entries = [entry for entry in self._entries if entry['lsn'] > folded_lsn]
+                data = b''.join(json.dumps(entry).encode() + b'\n' for entry in self._entries)
+                self._log_file.close()
+                _write_atomic(self.log_path, data)
+                self._log_file = open(self.log_path, 'ab')
+                self._log_size = len(data)
+            return len(entries)
+
+    def build_snapshot(self, entries):
+        """Bytes of the new base: the current CSV with entries appended under its header"""
+        # Copy the base bytes as-is and append the logged rows under its header
+        with open(self.base_path, 'rb') as f:
+            base = f.read()
+        header = next(csv.reader(io.StringIO(base.decode().split('\n', 1)[0].rstrip('\r'))))
+        buffer = io.StringIO()
+        if base and not base.endswith(b'\n'):
+            buffer.write('\n')
+        writer = csv.DictWriter(buffer, fieldnames=header, extrasaction='ignore', lineterminator='\n')
+        writer.writerows(entry['row'] for entry in entries)
+        return base + buffer.getvalue().encode()
+
+    def commit_snapshot(self, snapshot):
+        """Atomically make snapshot the base; after this, recovery treats its rows as folded"""
+        _write_atomic(self.base_path, snapshot)
+
+    def _compact_loop(self, interval):
+        while not self._closed.wait(interval):
+            try:
+                if len(self) >= self.compact_min_rows:
+                    start = time.perf_counter()
+                    folded = self.compact()
+                    print(f"Compacted {folded} logged rows into {self.base_path} "
+                          f"in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                print(f"Row log compaction failed for {self.base_path}: {e}")
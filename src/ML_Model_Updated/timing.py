@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import random
+import cProfile
+import threading
+from flask import request
+
+# The trace of the request (or background retrain) running on this thread, if any
+_current = threading.local()
+
+
+class Trace:
+    """Stage durations of one request, in the order the stages finished"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def server_timing(self):
+        """Server-Timing header value, e.g. 'parse;dur=0.041, forest;dur=2.310, total;dur=2.702'"""
+        entries = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.spans]
+        entries.append(f'total;dur={(time.perf_counter() - self.start) * 1000:.3f}')
+        return ', '.join(entries)
+
+    def summary(self):
+        return ', '.join(f'{name} {seconds * 1000:.1f}ms' for name, seconds in self.spans)
+
+
+def start_trace():
+    trace = _current.trace = Trace()
+    return trace
+
+
+def end_trace():
+    trace = getattr(_current, 'trace', None)
+    _current.trace = None
+    return trace
+
+
+class span:
+    """Times the enclosed block into this thread's trace; costs one attribute lookup without one"""
+
+    __slots__ = ('name', 'trace', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = getattr(_current, 'trace', None)
+        if self.trace is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.spans.append((self.name, time.perf_counter() - self.start))
+
+
+class RequestTiming:
+    """Flask hooks that trace each request into a Server-Timing header
+
+    A log_sample_rate fraction of requests is also printed as one JSON line. With
+    profiling enabled, a request sent with ?profile=1 or an X-Profile: 1 header runs
+    under cProfile and its stats are written to profile_directory (inspect them with
+    python -m pstats <file>); only one request is profiled at a time.
+    """
+
+    def __init__(self, log_sample_rate=0.0, profiling=False, profile_directory='profiles'):
+        self.log_sample_rate = log_sample_rate
+        self.profiling = profiling
+        self.profile_directory = profile_directory
+        # cProfile allows one active profiler per process
+        self._profile_lock = threading.Lock()
+
+    def install(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        return self
+
+    def _start(self):
+        start_trace()
+        if self.profiling and (request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'):
+            if self._profile_lock.acquire(blocking=False):
+                profiler = _current.profiler = cProfile.Profile()
+                profiler.enable()
+
+    def _finish(self, response):
+        profiler = getattr(_current, 'profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response.headers['X-Profile'] = self._save_profile(profiler)
+
+        trace = end_trace()
+        if trace is not None:
+            response.headers['Server-Timing'] = trace.server_timing()
+            if self.log_sample_rate and random.random() < self.log_sample_rate:
+                print(json.dumps({
+                    'event': 'request_timing',
+                    'endpoint': request.url_rule.rule if request.url_rule is not None else request.path,
+                    'method': request.method,
+                    'status': response.status_code,
+                    'total_ms': round((time.perf_counter() - trace.start) * 1000, 3),
+                    'spans_ms': [[name, round(seconds * 1000, 3)] for name, seconds in trace.spans],
+                }))
+        return response
+
+    def _teardown(self, exception):
+        # after_request is skipped when a view raises; never leave a trace or profiler behind
+        _current.trace = None
+        profiler = getattr(_current, 'profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _current.profiler = None
+            self._profile_lock.release()
+
+    def _save_profile(self, profiler):
+        os.makedirs(self.profile_directory, exist_ok=True)
+        name = request.path.strip('/').replace('/', '_') or 'root'
+        path = os.path.join(self.profile_directory, f"{name}-{int(time.time() * 1000)}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        print(f"Profiled {request.method} {request.path} to {path}")
+        return path
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory is then reported as unknown
+    resource = None
+
+# Runtime handles that stay in the serving process and are never sent to a fit worker
+LOCAL_ATTRIBUTES = ('dataset', '_buffers', 'write_lock', '_fingerprint')
+
+
+def _detached(predictor):
+    """Shallow clone of predictor without its dataset log, thread-local buffers and writer lock"""
+    clone = object.__new__(type(predictor))
+    clone.__dict__.update({
+        name: value for name, value in predictor.__dict__.items() if name not in LOCAL_ATTRIBUTES
+    })
+    return clone
+
+
+def _fit(predictor_class, model_params, inputs, n_jobs):
+    """Runs in a fresh worker process: fit with n_jobs tree-building threads and measure it
+
+    The worker gets the predictor's training_inputs() and model parameters, never its
+    feature arrays, and sends back only the fitted ARTIFACT_ATTRIBUTES.
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    predictor = object.__new__(predictor_class)
+    predictor.model_params = model_params
+    predictor.n_jobs = n_jobs
+    predictor.train_model(inputs)
+    stats = {
+        'wall_seconds': time.perf_counter() - wall_start,
+        'cpu_seconds': time.process_time() - cpu_start,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    }
+    return {name: getattr(predictor, name) for name in predictor_class.ARTIFACT_ATTRIBUTES}, stats
+
+
+class CoreBudget:
+    """Cores shared by every fit and hyperparameter search in this process, so together they stay within it"""
+
+    def __init__(self, cores=None):
+        # Leave a core for the serving threads unless told otherwise
+        self.cores = cores or max(1, (os.cpu_count() or 2) - 1)
+        self._free = self.cores
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, cores):
+        """Hold up to `cores` of the budget, waiting until at least one is free; yields how many were granted"""
+        with self._condition:
+            while self._free == 0:
+                self._condition.wait()
+            granted = min(cores, self._free)
+            self._free -= granted
+        try:
+            yield granted
+        finally:
+            with self._condition:
+                self._free += granted
+                self._condition.notify_all()
+
+
+class TrainingOrchestrator:
+    """Fits predictors in a process pool, splitting a core budget between concurrent fits
+
+    core_budget is a CoreBudget shared with other users of those cores (the tuner) or
+    a number of cores for this orchestrator alone.
+    """
+
+    def __init__(self, core_budget=None, max_parallel_fits=2):
+        self.budget = core_budget if isinstance(core_budget, CoreBudget) else CoreBudget(core_budget)
+        self.max_parallel_fits = max(1, min(max_parallel_fits, self.budget.cores))
+        self.jobs_per_fit = max(1, self.budget.cores // self.max_parallel_fits)
+
+        # One process per fit so peak RSS is per fit; forkserver keeps sklearn preloaded where available
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['forecasting'])
+        else:
+            context = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(
+            self.max_parallel_fits, mp_context=context, max_tasks_per_child=1
+        )
+
+    def train(self, predictor):
+        """Fit predictor in the pool and copy the fitted state back; blocks until done"""
+        # Fewer threads than jobs_per_fit while a search holds part of the budget
+        inputs = predictor.training_inputs()
+        with self.budget.reserve(self.jobs_per_fit) as jobs:
+            fitted, stats = self.pool.submit(_fit, type(predictor), predictor.model_params, inputs, jobs).result()
+        # Only the fitted state comes back; the feature arrays stay the ones this process appends to
+        for name, value in fitted.items():
+            setattr(predictor, name, value)
+
+        peak = f"{stats['peak_rss_mb']:.0f} MB" if stats['peak_rss_mb'] is not None else 'unknown'
+        print(f"{type(predictor).__name__} fit with {jobs} jobs: "
+              f"wall {stats['wall_seconds']:.2f}s, cpu {stats['cpu_seconds']:.2f}s, peak RSS {peak}")
+        return stats
+
+
+def bench(sizes=(10_000, 200_000, 1_000_000), window=5000):
+    """Bytes sent to the fit worker and orchestrated fit time of RequirementPredictor, as its history grows"""
+    import pickle
+    import shutil
+    import tempfile
+    import numpy as np
+    from forecasting import RequirementPredictor, synthetic_requirements
+    from training_set import TrainingPolicy
+
+    orchestrator = TrainingOrchestrator()
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>9} {'train rows':>11} {'whole predictor MB':>19} {'inputs MB':>10} {'fit s':>7}")
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix='orchestrator-bench-')
+        try:
+            csv_path = os.path.join(directory, 'drugs.csv')
+            synthetic_requirements(size, rng).to_csv(csv_path, index=False)
+            predictor = RequirementPredictor(csv_path)
+            predictor.training_policy = TrainingPolicy(window=window)
+            predictor.preprocess_data()
+
+            # What used to be pickled for every fit, against what is now
+            whole = len(pickle.dumps(_detached(predictor), protocol=pickle.HIGHEST_PROTOCOL))
+            inputs = len(pickle.dumps(predictor.training_inputs(), protocol=pickle.HIGHEST_PROTOCOL))
+            start = time.perf_counter()
+            orchestrator.train(predictor)
+            print(f"{size:>9,} {predictor.training_size:>11,} {whole / 2 ** 20:>19.2f} "
+                  f"{inputs / 2 ** 20:>10.2f} {time.perf_counter() - start:>7.2f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    orchestrator.pool.shutdown()
+
+
+if __name__ == '__main__':
+    # Orchestrated fit cost as the dataset grows: python training_orchestrator.py
+    bench()
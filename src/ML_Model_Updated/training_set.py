@@ -0,0 +1,195 @@
+# Which rows a forecasting predictor trains on, so retrain cost stops growing with its dataset.
+#
+# Every prediction request appends a row, so the datasets grow without bound even though
+# most rows repeat a (month, department) or (month, item) seen many times before. The
+# dataset itself keeps every row; a TrainingPolicy only bounds what train_model sees:
+#
+#     TRAINING_WINDOW=5000       the most recent 5000 rows
+#     TRAINING_SAMPLE=5000       a weighted reservoir sample of 5000 rows, where a row's weight
+#                                doubles every TRAINING_SAMPLE_HALF_LIFE rows (default 5000),
+#                                so recent rows dominate but older seasons stay represented
+#     TRAINING_AGGREGATE=1       then collapse repeated observations into one summary row
+#                                each, with the mean target and the count as its sample weight
+#
+# Whatever the policy, a fixed fifth of the rows (picked by held_out from each row's position)
+# never trains any fit or incremental update, so every model can be scored on them.
+#
+# A policy bounds the fit and what TrainingOrchestrator sends to its fit process, not the
+# rest: preprocess_data still reads and encodes every row, the holdout split runs over
+# every row when there is no policy, and the dataset on disk keeps every row. Those grow
+# with the history; bounding them would take compacting old rows into aggregated rows
+# with counts, which the datasets don't do.
+#
+#     python training_set.py     # training rows and fit time per policy as the dataset grows
+import math
+import numpy as np
+
+
+# Share of rows held out of training for scoring
+HOLDOUT_FRACTION = 0.2
+
+
+def _uniform(indices, stream=0):
+    """Uniform (0, 1) numbers fixed per row index (splitmix64), so a sample never depends on batching
+
+    Each stream gives an independent set of numbers for the same indices.
+    """
+    with np.errstate(over='ignore'):
+        z = indices.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15) * np.uint64(stream + 1)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    return ((z >> np.uint64(11)).astype(np.float64) + 0.5) / 2.0 ** 53
+
+
+class TrainingPolicy:
+    """Picks the training rows of a dataset that only grows; see the top of this file"""
+
+    def __init__(self, window=None, sample=None, half_life=5000, aggregate=False):
+        self.window = window
+        self.sample = sample
+        self.half_life = half_life
+        self.aggregate = aggregate
+        # Reservoir of the sample rows with the largest keys, over the rows seen so far
+        self._keys = np.empty(0)
+        self._indices = np.empty(0, dtype=np.int64)
+        self._seen = 0
+
+    @classmethod
+    def from_environment(cls, environ):
+        """Policy from TRAINING_WINDOW, TRAINING_SAMPLE(_HALF_LIFE) and TRAINING_AGGREGATE; None for all rows"""
+        policy = cls(
+            window=int(environ.get('TRAINING_WINDOW', 0)) or None,
+            sample=int(environ.get('TRAINING_SAMPLE', 0)) or None,
+            half_life=float(environ.get('TRAINING_SAMPLE_HALF_LIFE', 5000)),
+            aggregate=environ.get('TRAINING_AGGREGATE') == '1'
+        )
+        return policy if policy.window or policy.sample or policy.aggregate else None
+
+    def __str__(self):
+        parts = []
+        if self.window:
+            parts.append(f'window={self.window}')
+        if self.sample:
+            parts.append(f'sample={self.sample}/{self.half_life:g}')
+        if self.aggregate:
+            parts.append('aggregate')
+        return ','.join(parts) or 'all'
+
+    def select(self, rows):
+        """Sorted indices of the rows to train on, out of the first rows of the dataset
+
+        Sampling keeps its reservoir between calls, so each call only looks at the rows
+        added since the last one.
+        """
+        if self.sample:
+            return self._sampled(rows)
+        return np.arange(max(0, rows - self.window) if self.window else 0, rows)
+
+    def _sampled(self, rows):
+        # Weighted sampling without replacement (Efraimidis-Spirakis): keep the rows with the
+        # largest u ** (1 / weight). With weight 2 ** (index / half_life) that ranks the same
+        # as index * ln 2 / half_life - log(-log u), which never overflows
+        if rows > self._seen:
+            new = np.arange(self._seen, rows)
+            keys = new * (math.log(2) / self.half_life) - np.log(-np.log(_uniform(new)))
+            keys = np.concatenate([self._keys, keys])
+            indices = np.concatenate([self._indices, new])
+            if len(keys) > self.sample:
+                keep = np.argpartition(keys, len(keys) - self.sample)[-self.sample:]
+                keys, indices = keys[keep], indices[keep]
+            self._keys, self._indices, self._seen = keys, indices, rows
+
+        # A view older than the rows seen so far (a failed retrain appended past it) gets
+        # the part of the current sample it holds
+        indices = np.sort(self._indices)
+        return indices[indices < rows] if rows < self._seen else indices
+
+
+def held_out(positions, fraction=HOLDOUT_FRACTION):
+    """Whether each row position of a dataset is in its holdout
+
+    Membership depends only on the position, so a row held out of one fit is held out of
+    every later fit and incremental update as well.
+    """
+    return _uniform(np.asarray(positions, dtype=np.int64), stream=1) < fraction
+
+
+def aggregate(groups, values):
+    """Mean of each values column (over its non-missing values) per distinct combination of the groups columns, and the counts
+
+    groups and values map column names to equal-length arrays; rows come back in order of
+    their group's first appearance.
+    """
+    keys = np.column_stack(list(groups.values())) if groups else np.zeros((0, 0))
+    _, first, inverse, counts = np.unique(keys, axis=0, return_index=True, return_inverse=True,
+                                          return_counts=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(first, kind='stable')
+    # Renumber groups by first appearance
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    inverse = position[inverse]
+
+    aggregated = {name: column[first[order]] for name, column in groups.items()}
+    for name, column in values.items():
+        present = ~np.isnan(column)
+        totals = np.bincount(inverse[present], weights=column[present], minlength=len(order))
+        with np.errstate(invalid='ignore'):
+            aggregated[name] = totals / np.bincount(inverse[present], minlength=len(order))
+    return aggregated, counts[order].astype(float)
+
+
+def training_columns(features, policy, index, groups, values):
+    """Columns of features (text ones as codes) at the rows index picked, their sample weights, and the held-out columns
+
+    index is what policy.select gave for features, or None for every row. Picked rows
+    in the holdout come back separately, one row each, unless every picked row is. With an aggregating policy, the
+    other rows sharing their groups columns become one row weighted by their count;
+    otherwise the weights are None, since passing any sample_weight changes how the
+    forest draws its bootstrap samples.
+    """
+    positions = np.arange(len(features)) if index is None else index
+    test = held_out(positions)
+    # A handful of rows that all fall in the holdout still have to train something
+    if test.all():
+        test[:] = False
+    names = list(groups) + list(values)
+    columns = {name: features.values(name)[positions[~test]] for name in names}
+    holdout = {name: features.values(name)[positions[test]] for name in names}
+    if policy is None or not policy.aggregate:
+        return columns, None, holdout
+    columns, weight = aggregate({name: columns[name] for name in groups},
+                                {name: columns[name].astype(float) for name in values})
+    return columns, weight, holdout
+
+
+def bench(sizes=(10_000, 50_000, 200_000)):
+    """Training rows and fit time of RequirementPredictor per policy, at growing dataset sizes"""
+    import os
+    import time
+    import shutil
+    import tempfile
+    from forecasting import RequirementPredictor, synthetic_requirements
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>9} {'policy':>24} {'train rows':>11} {'fit s':>7}")
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix='training-set-bench-')
+        try:
+            csv_path = os.path.join(directory, 'drugs.csv')
+            synthetic_requirements(size, rng).to_csv(csv_path, index=False)
+            for policy in (None, TrainingPolicy(window=5000), TrainingPolicy(sample=5000),
+                           TrainingPolicy(aggregate=True), TrainingPolicy(sample=5000, aggregate=True)):
+                predictor = RequirementPredictor(csv_path)
+                predictor.training_policy = policy
+                predictor.preprocess_data()
+                start = time.perf_counter()
+                predictor.train_model()
+                print(f"{size:>9,} {str(policy or 'all'):>24} {len(predictor.y):>11,} {time.perf_counter() - start:>7.2f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    bench()
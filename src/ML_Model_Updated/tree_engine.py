@@ -0,0 +1,284 @@
+import json
+import sys
+import time
+import pickle
+import numpy as np
+
+# Objectives whose raw margin is already the prediction
+IDENTITY_OBJECTIVES = ('reg:squarederror', 'reg:absoluteerror', 'reg:pseudohubererror', 'reg:linear')
+
+
+class FlatEnsemble:
+    """Tree ensemble flattened into parallel NumPy arrays, evaluated over all trees at once"""
+
+    def __init__(self, feature, threshold, left, right, default_left, value, roots,
+                 depth, base_score, scale, strict):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+        self.base_score = float(base_score)
+        self.scale = float(scale)
+        # XGBoost sends x < threshold left, sklearn sends x <= threshold left
+        self.strict = bool(strict)
+
+        # Child of node i is children[2 * i + go_right]; leaves point at themselves
+        self._children = np.stack([left, right], axis=1).ravel().astype(np.intp)
+        self._feature = feature.astype(np.intp)
+        self._roots = roots.astype(np.intp)
+
+    def predict(self, X, chunk_size=256):
+        """Predict like the original model, vectorized across rows and trees"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n_rows, n_features = X.shape
+        has_missing = bool(np.isnan(X).any())
+
+        # Walk rows in small chunks so the node index matrix stays in cache
+        flat_X = X.ravel()
+        totals = np.empty(n_rows, dtype=self.value.dtype)
+        for start in range(0, n_rows, chunk_size):
+            stop = min(start + chunk_size, n_rows)
+            chunk = flat_X[start * n_features:stop * n_features]
+            offsets = (np.arange(stop - start, dtype=np.intp) * n_features)[:, None]
+            nodes = np.repeat(self._roots[None, :], stop - start, axis=0)
+
+            # Walking max depth steps lands every row on a leaf in every tree
+            for _ in range(self.depth):
+                x = np.take(chunk, offsets + np.take(self._feature, nodes))
+                threshold = np.take(self.threshold, nodes)
+                go_right = x >= threshold if self.strict else x > threshold
+                if has_missing:
+                    missing = np.isnan(x)
+                    go_right[missing] = ~np.take(self.default_left, nodes)[missing]
+                nodes = np.take(self._children, nodes * 2 + go_right)
+
+            totals[start:stop] = np.take(self.value, nodes).sum(axis=1, dtype=self.value.dtype)
+
+        return self.base_score + self.scale * totals
+
+    def save(self, path):
+        """Write the flat arrays to an .npz file"""
+        np.savez(
+            path,
+            feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+            default_left=self.default_left, value=self.value, roots=self.roots,
+            meta=np.array([self.depth, self.base_score, self.scale, self.strict], dtype=np.float64)
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read flat arrays written by save"""
+        with np.load(path) as arrays:
+            depth, base_score, scale, strict = arrays['meta']
+            return cls(
+                arrays['feature'], arrays['threshold'], arrays['left'], arrays['right'],
+                arrays['default_left'], arrays['value'], arrays['roots'],
+                depth, base_score, scale, strict
+            )
+
+
+class _NodeBuffer:
+    """Collects nodes of many trees into flat lists"""
+
+    def __init__(self):
+        self.feature = []
+        self.threshold = []
+        self.left = []
+        self.right = []
+        self.default_left = []
+        self.value = []
+        self.roots = []
+        self.depth = 0
+
+    def add(self, feature, threshold, left, right, default_left, value):
+        self.feature.append(feature)
+        self.threshold.append(threshold)
+        self.left.append(left)
+        self.right.append(right)
+        self.default_left.append(default_left)
+        self.value.append(value)
+
+    def build(self, threshold_dtype, value_dtype, base_score, scale, strict):
+        return FlatEnsemble(
+            np.array(self.feature, dtype=np.int32),
+            np.array(self.threshold, dtype=threshold_dtype),
+            np.array(self.left, dtype=np.int32),
+            np.array(self.right, dtype=np.int32),
+            np.array(self.default_left, dtype=bool),
+            np.array(self.value, dtype=value_dtype),
+            np.array(self.roots, dtype=np.int32),
+            self.depth, base_score, scale, strict
+        )
+
+
+def _add_sklearn_tree(buffer, tree):
+    """Append one fitted sklearn tree_ to the buffer"""
+    offset = len(buffer.feature)
+    buffer.roots.append(offset)
+    buffer.depth = max(buffer.depth, tree.max_depth)
+    missing_left = getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=bool))
+    for node in range(tree.node_count):
+        if tree.children_left[node] == -1:
+            buffer.add(0, 0.0, offset + node, offset + node, False, tree.value[node, 0, 0])
+        else:
+            buffer.add(
+                tree.feature[node], tree.threshold[node],
+                offset + tree.children_left[node], offset + tree.children_right[node],
+                bool(missing_left[node]), 0.0
+            )
+
+
+def _add_xgboost_tree(buffer, tree, feature_index):
+    """Append one tree from an XGBoost JSON dump to the buffer"""
+    offset = len(buffer.feature)
+    buffer.roots.append(offset)
+
+    # Node ids are dense per tree, so they map straight to flat positions
+    nodes = {}
+    stack = [(tree, 0)]
+    while stack:
+        node, depth = stack.pop()
+        nodes[node['nodeid']] = node
+        buffer.depth = max(buffer.depth, depth)
+        for child in node.get('children', []):
+            stack.append((child, depth + 1))
+
+    for node_id in range(len(nodes)):
+        node = nodes[node_id]
+        if 'leaf' in node:
+            buffer.add(0, 0.0, offset + node_id, offset + node_id, False, node['leaf'])
+        else:
+            buffer.add(
+                feature_index[node['split']], node['split_condition'],
+                offset + node['yes'], offset + node['no'],
+                node['missing'] == node['yes'], 0.0
+            )
+
+
+def _flatten_xgboost(model):
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    config = json.loads(booster.save_config())['learner']
+    if config['gradient_booster']['name'] != 'gbtree':
+        raise ValueError(f"Unsupported XGBoost booster: {config['gradient_booster']['name']}")
+    if config['objective']['name'] not in IDENTITY_OBJECTIVES:
+        raise ValueError(f"Unsupported XGBoost objective: {config['objective']['name']}")
+
+    # Newer releases store base_score as a one-element list, e.g. '[4.85E0]'
+    base_score = float(config['learner_model_param']['base_score'].strip('[]'))
+    feature_names = booster.feature_names or [f'f{i}' for i in range(booster.num_features())]
+    feature_index = {name: index for index, name in enumerate(feature_names)}
+
+    buffer = _NodeBuffer()
+    for dump in booster.get_dump(dump_format='json'):
+        _add_xgboost_tree(buffer, json.loads(dump), feature_index)
+    return buffer.build(np.float32, np.float32, base_score, 1.0, strict=True)
+
+
+def _flatten_sklearn(model):
+    buffer = _NodeBuffer()
+    name = type(model).__name__
+
+    if name in ('RandomForestRegressor', 'ExtraTreesRegressor'):
+        for estimator in model.estimators_:
+            _add_sklearn_tree(buffer, estimator.tree_)
+        return buffer.build(np.float64, np.float64, 0.0, 1.0 / len(model.estimators_), strict=False)
+
+    if name in ('DecisionTreeRegressor', 'ExtraTreeRegressor'):
+        _add_sklearn_tree(buffer, model.tree_)
+        return buffer.build(np.float64, np.float64, 0.0, 1.0, strict=False)
+
+    if name == 'GradientBoostingRegressor':
+        for estimator in model.estimators_[:, 0]:
+            _add_sklearn_tree(buffer, estimator.tree_)
+        if model.init_ == 'zero':
+            base_score = 0.0
+        else:
+            base_score = float(np.ravel(model.init_.predict(np.zeros((1, model.n_features_in_))))[0])
+        return buffer.build(np.float64, np.float64, base_score, model.learning_rate, strict=False)
+
+    raise ValueError(f"Unsupported model type: {name}")
+
+
+def flatten(model):
+    """Export a fitted XGBoost or sklearn tree ensemble regressor to a FlatEnsemble"""
+    if type(model).__module__.startswith('xgboost'):
+        return _flatten_xgboost(model)
+    return _flatten_sklearn(model)
+
+
+class FastPathModel:
+    """Serves small batches from a FlatEnsemble and large ones from the original model"""
+
+    def __init__(self, model, max_rows=256):
+        self.model = model
+        self.ensemble = flatten(model)
+        self.max_rows = max_rows
+
+    def predict(self, X):
+        if len(X) <= self.max_rows:
+            return self.ensemble.predict(X)
+        return self.model.predict(X)
+
+
+def _sample_inputs(ensemble, n_rows, seed=0):
+    """Random rows spanning every split threshold of the ensemble"""
+    rng = np.random.default_rng(seed)
+    internal = ensemble.left != np.arange(len(ensemble.left))
+    n_features = int(ensemble.feature.max()) + 1
+    X = np.empty((n_rows, n_features), dtype=np.float32)
+    for column in range(n_features):
+        thresholds = ensemble.threshold[internal & (ensemble.feature == column)]
+        low, high = (thresholds.min() - 1, thresholds.max() + 1) if len(thresholds) else (0, 1)
+        # Integer values land exactly on the integer thresholds, so ties get exercised too
+        X[:, column] = np.round(rng.uniform(low, high, n_rows))
+    return X
+
+
+def _time_call(function, X, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(X)
+    return (time.perf_counter() - start) / repeat
+
+
+def check(model_path):
+    """Parity test against the pickled model's predict, plus a 1 row / 10k row microbenchmark"""
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    ensemble = flatten(model)
+
+    X = _sample_inputs(ensemble, 10000)
+    expected = model.predict(X)
+    actual = ensemble.predict(X)
+    max_error = float(np.max(np.abs(expected - actual)))
+    assert np.allclose(expected, actual, rtol=1e-5, atol=1e-4), f"Parity check failed, max error {max_error}"
+    print(f"{model_path}: parity OK on {len(X)} rows (max abs error {max_error:.2e})")
+
+    for n_rows, repeat in ((1, 2000), (10000, 10)):
+        rows = X[:n_rows]
+        original = _time_call(model.predict, rows, repeat)
+        flat = _time_call(ensemble.predict, rows, repeat)
+        print(f"  {n_rows:>5} rows: predict {original * 1e6:10.1f} us, "
+              f"flat {flat * 1e6:10.1f} us, speedup {original / flat:5.1f}x")
+
+
+if __name__ == '__main__':
+    # python tree_engine.py export model.pkl [model.npz]
+    # python tree_engine.py check model.pkl
+    if len(sys.argv) >= 3 and sys.argv[1] == 'export':
+        with open(sys.argv[2], 'rb') as f:
+            ensemble = flatten(pickle.load(f))
+        out_path = sys.argv[3] if len(sys.argv) > 3 else sys.argv[2].rsplit('.', 1)[0] + '.npz'
+        ensemble.save(out_path)
+        print(f"Exported {len(ensemble.roots)} trees, {len(ensemble.feature)} nodes to {out_path}")
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'check':
+        for path in sys.argv[2:]:
+            check(path)
+    else:
+        print("Usage: python tree_engine.py export MODEL.pkl [OUT.npz] | check MODEL.pkl [MODEL.pkl ...]")
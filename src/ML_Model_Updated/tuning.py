@@ -0,0 +1,203 @@
+# Hyperparameter search for the forecasting predictors, off the serving path.
+#
+# A search is successive halving over random candidates from the predictor's SEARCH_SPACE
+# (sklearn's HalvingRandomSearchCV): every candidate is scored on a small sample of rows,
+# and only the best third goes on to three times as many, until the survivors see all
+# of them. Candidate fits run in parallel on up to half the TRAINING_CORE_BUDGET cores,
+# a budget app.py shares with the retrain fits, so the two together never exceed it.
+#
+# The best parameters are cached in model_artifacts/tuning.json with the fingerprint and
+# shape of the data they were tuned on. A predictor picks them up before its first fit,
+# so serving starts tuned without searching, and a new search only runs once the data
+# has drifted: new feature columns, or the row count moved by more than drift_fraction.
+#
+#     python tuning.py                     # tune both predictors now and cache the results
+#
+# With HYPERPARAMETER_TUNING=1, app.py also searches in the background whenever the
+# cached parameters are missing or stale, then refits with the new ones.
+import os
+import json
+import time
+import queue
+import weakref
+import threading
+# Successive halving is still behind sklearn's experimental flag
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingRandomSearchCV
+from sklearn.pipeline import make_pipeline
+from sklearn.impute import SimpleImputer
+from sklearn.ensemble import RandomForestRegressor
+from training_orchestrator import CoreBudget
+
+CACHE_PATH = os.path.join('model_artifacts', 'tuning.json')
+
+
+def dataset_key(predictor):
+    """Cache key of a predictor's dataset; hospitals share classes but not datasets"""
+    return f'{type(predictor).__name__}:{predictor.csv_path}'
+
+
+class TuningCache:
+    """Best parameters per dataset, with the data they were tuned on, in one JSON file"""
+
+    def __init__(self, path=CACHE_PATH, drift_fraction=0.2):
+        self.path = path
+        self.drift_fraction = drift_fraction
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Ignoring unreadable tuning cache {self.path}: {e}")
+            return {}
+
+    def get(self, predictor):
+        """The latest search result for predictor's dataset, or None"""
+        with self._lock:
+            return self._read().get(dataset_key(predictor))
+
+    def put(self, predictor, result):
+        with self._lock:
+            results = self._read()
+            results[dataset_key(predictor)] = result
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(results, f, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+
+    def drifted(self, result, predictor):
+        """Whether predictor's data has moved far enough from result's to search again"""
+        if result is None:
+            return True
+        if result['fingerprint'] == predictor.data_fingerprint:
+            return False
+        rows = len(predictor.features)
+        return (result['columns'] != predictor.feature_columns
+                or abs(rows - result['rows']) > self.drift_fraction * result['rows'])
+
+
+def search(predictor, n_jobs=None, random_state=42):
+    """Successive-halving search over predictor.SEARCH_SPACE on its preprocessed data; returns the result"""
+    start = time.perf_counter()
+    # Imputation inside the pipeline, so every fold fills missing values from its own training rows
+    estimator = make_pipeline(
+        SimpleImputer(strategy='median', keep_empty_features=True),
+        RandomForestRegressor(**predictor.MODEL_PARAMS, random_state=random_state)
+    )
+    space = {f'randomforestregressor__{name}': values for name, values in predictor.SEARCH_SPACE.items()}
+    halving = HalvingRandomSearchCV(
+        estimator, space, factor=3, cv=3, scoring='neg_mean_squared_error',
+        random_state=random_state, n_jobs=n_jobs
+    )
+    halving.fit(predictor.X.to_numpy(float), predictor.y.to_numpy(float),
+                randomforestregressor__sample_weight=predictor.sample_weight)
+
+    prefix = len('randomforestregressor__')
+    return {
+        'params': {name[prefix:]: value for name, value in halving.best_params_.items()},
+        'mse': -float(halving.best_score_),
+        'candidates': len(halving.cv_results_['params']),
+        'iterations': int(halving.n_iterations_),
+        'fingerprint': predictor.data_fingerprint,
+        'rows': len(predictor.features),
+        'columns': predictor.feature_columns,
+        'seconds': time.perf_counter() - start,
+        'time': time.time(),
+    }
+
+
+class HyperparameterTuner:
+    """Applies cached parameters to predictors and refreshes stale ones with background searches"""
+
+    def __init__(self, cache=None, n_jobs=None, check_interval=300.0, budget=None):
+        self.cache = cache or TuningCache()
+        # Cores searches hold while they run, shared with a TrainingOrchestrator's fits if given
+        self.budget = budget or CoreBudget(n_jobs)
+        # At most half the budget by default, so retrains still get cores during a long search
+        self.n_jobs = n_jobs or max(1, self.budget.cores // 2)
+        # How often watched retrain workers are checked for drift
+        self.check_interval = check_interval
+        self._watched = weakref.WeakSet()
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def apply(self, predictor):
+        """Set predictor's model parameters from the cache; True if it needs a new search"""
+        result = self.cache.get(predictor)
+        if result is not None:
+            predictor.model_params = result['params']
+        return self.cache.drifted(result, predictor)
+
+    def watch(self, retrainer):
+        """Search in the background for this worker's predictor now if needed, and whenever its data drifts"""
+        with self._lock:
+            self._watched.add(retrainer)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._check(retrainer)
+        return retrainer
+
+    def _check(self, retrainer):
+        predictor = retrainer.current
+        if predictor.features is None or not self.cache.drifted(self.cache.get(predictor), predictor):
+            return
+        with self._lock:
+            # One queued search per dataset; it reads the latest data when it starts
+            key = dataset_key(predictor)
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put(retrainer)
+
+    def _run(self):
+        while True:
+            try:
+                retrainer = self._queue.get(timeout=self.check_interval)
+            except queue.Empty:
+                for retrainer in list(self._watched):
+                    self._check(retrainer)
+                continue
+
+            predictor = retrainer.current
+            try:
+                with self.budget.reserve(self.n_jobs) as n_jobs:
+                    result = search(predictor, n_jobs)
+                self.cache.put(predictor, result)
+            except Exception as e:
+                print(f"Hyperparameter search for {dataset_key(predictor)} failed: {e}")
+                continue
+            finally:
+                with self._lock:
+                    self._pending.discard(dataset_key(predictor))
+            print(f"Tuned {dataset_key(predictor)} in {result['seconds']:.1f}s over {result['candidates']} "
+                  f"candidates: {result['params']} (CV MSE {result['mse']:.1f})")
+
+            # Retrains copy the serving predictor, so the next one fits with the new parameters
+            # (swaps happen under the worker's write lock)
+            with retrainer.write_lock:
+                current = retrainer.current
+                changed = result['params'] != current.model_params
+                current.model_params = result['params']
+            if changed:
+                retrainer.request_refit()
+
+
+if __name__ == '__main__':
+    from forecasting import PatientPredictor, RequirementPredictor
+
+    cache = TuningCache()
+    n_jobs = int(os.environ.get('TRAINING_CORE_BUDGET', 0)) or -1
+    for predictor_class in (PatientPredictor, RequirementPredictor):
+        predictor = predictor_class()
+        predictor.preprocess_data()
+        result = search(predictor, n_jobs)
+        cache.put(predictor, result)
+        print(f"{predictor_class.__name__}: {result['params']} CV MSE {result['mse']:.1f} "
+              f"({result['candidates']} candidates, {result['iterations']} rounds, {result['seconds']:.1f}s)")